@@ -5,17 +5,34 @@
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 from typing import Literal, Optional, List
+import functools
+import os
 import uvicorn
 
+# orjson serializa la respuesta anidada más rápido que json; si no está instalado se usa el de FastAPI
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as RespuestaJSON
+except ImportError:
+    RespuestaJSON = JSONResponse
+
 # Importa tu script del CBR (asegúrate que el archivo se llame cbr_cafe.py y esté en la misma carpeta)
-from cbr_cafe import run_cbr
+from cbr_cafe import build_index, query_index, cerrar_pool
+
+# YAML de casos A y B cargados al arrancar; CBR_DATA_PATHS (separadas por os.pathsep) los reemplaza
+DEFAULT_DATA = (
+    os.environ["CBR_DATA_PATHS"].split(os.pathsep) if os.environ.get("CBR_DATA_PATHS")
+    else ["CBR_Cafe_Cauca_A.yaml", "CBR_Cafe_Cauca_B_historicos.yaml"]
+)
 
 app = FastAPI(
     title="CBR Café – Cauca",
     description="API REST del sistema de recomendación basado en casos (CBR) para el cultivo de café en el Cauca.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=RespuestaJSON
 )
 
 app.add_middleware(
@@ -31,7 +48,7 @@ app.add_middleware(
 # ======================
 class CBRRequest(BaseModel):
     data: List[str] = Field(
-        default=["CBR_Cafe_Cauca_A.yaml", "CBR_Cafe_Cauca_B_historicos.yaml"],
+        default=DEFAULT_DATA,
         description="Rutas a los YAML de casos A y B"
     )
     tipo: Literal["auto", "almacigos", "fertilizacion_sin_analisis", "broca"] = "auto"
@@ -62,6 +79,34 @@ class CBRRequest(BaseModel):
     save_case_to: Optional[str] = "CBR_Cafe_Cauca_C.yaml"
 
 
+# ======================
+# Carga del índice (una vez, al arrancar) y cierre al apagar
+# ======================
+@app.on_event("startup")
+def cargar_indice():
+    # DEFAULT_DATA lo fija el servidor (no el cliente): puede usar la caché pickle junto al YAML
+    app.state.cbr_index = build_index(DEFAULT_DATA, usar_sidecar=True)
+    _consulta_cacheada.cache_clear()
+
+
+@app.on_event("shutdown")
+def cerrar_recursos():
+    cerrar_pool()
+
+
+# ======================
+# Caché de consultas repetidas (índice por defecto, sin guardar caso)
+# ======================
+def _clave_consulta(params: dict) -> tuple:
+    """Parámetros como tupla ordenada y hashable (las listas pasan a tuplas)."""
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items()))
+
+@functools.lru_cache(maxsize=256)
+def _consulta_cacheada(clave: tuple):
+    # El índice no cambia durante la vida del proceso; el dict devuelto se comparte y no debe modificarse
+    return query_index(app.state.cbr_index, dict(clave), verbose=False)
+
+
 # ======================
 # Endpoints
 # ======================
@@ -70,15 +115,26 @@ class CBRRequest(BaseModel):
 def root():
     return {"mensaje": "API del CBR Café Cauca funcionando"}
 
-@app.post("/cbr/recomendar")
+@app.post("/cbr/recomendar", response_class=RespuestaJSON)
 def recomendar_cbr(body: CBRRequest):
     """
     Ejecuta el CBR con los parámetros recibidos.
-    Devuelve el mismo JSON que arma run_cbr().
+    Devuelve el mismo JSON que arma query_index() (equivalente a run_cbr()).
     """
     try:
-        params = body.dict()
-        resultado = run_cbr(params, verbose=False)
+        # model_dump (Pydantic v2) es el volcado nativo y más rápido; .dict() queda para v1
+        params = body.model_dump() if hasattr(body, "model_dump") else body.dict()
+        # Con los YAML por defecto se reutiliza el índice precargado; otras rutas se cargan a demanda.
+        # Guardar el caso (save_case_to) es un efecto secundario: esas consultas no se cachean.
+        # Las rutas del cliente se cargan sin caché pickle (build_index por defecto): no se deserializa
+        # ni se escribe nada junto a archivos que elige el cliente.
+        # Se compara con las rutas del índice precargado (paths): caché e índice no pueden divergir.
+        precargado = params["data"] == list(app.state.cbr_index.paths)
+        if precargado and not params.get("save_case_to"):
+            resultado = _consulta_cacheada(_clave_consulta(params))
+        else:
+            index = app.state.cbr_index if precargado else build_index(params["data"])
+            resultado = query_index(index, params, verbose=False)
         if not resultado:
             raise HTTPException(status_code=400, detail="No se generó salida desde el CBR (revisa los YAML).")
         return resultado
@@ -21,7 +21,9 @@ python cbr_cafe.py --data CBR_Cafe_Cauca_A.yaml CBR_Cafe_Cauca_B_historicos.yaml
   --save_case_to CBR_Cafe_Cauca_C.yaml
 """
 
-import argparse, math, json, sys, re
+import argparse, math, os, sys, re, functools, pickle, mmap, types, threading, atexit
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
 try:
@@ -30,6 +32,30 @@ except Exception:
     print("ERROR: Se requiere PyYAML (pip install pyyaml).", file=sys.stderr)
     sys.exit(1)
 
+# Parser/emisor en C (libyaml) si PyYAML se instaló con él; mismas reglas que safe_load/safe_dump
+try:
+    from yaml import CSafeLoader as _SafeLoader, CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader, SafeDumper as _SafeDumper
+
+try:
+    import numpy as np
+except Exception:
+    print("ERROR: Se requiere NumPy (pip install numpy).", file=sys.stderr)
+    sys.exit(1)
+
+# fcntl (solo POSIX) bloquea el archivo de conteo del Dataset C entre procesos
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Opcional: si Numba está instalado, el puntaje de similitud se compila (ver _score_numba)
+try:
+    from numba import njit
+except Exception:
+    njit = None
+
 MESES = ["enero","febrero","marzo","abril","mayo","junio",
          "julio","agosto","septiembre","octubre","noviembre","diciembre"]
 
@@ -56,11 +82,18 @@ APLICA_DOMINIO = {
 # =========================
 # Utilidades numéricas
 # =========================
+# sin/cos del mes (variable circular) precalculados para los 12 meses
+_MES_SIN = np.array([math.sin(2.0 * math.pi * (i / 12.0)) for i in range(12)])
+_MES_COS = np.array([math.cos(2.0 * math.pi * (i / 12.0)) for i in range(12)])
+# Misma tabla como floats de Python para la consulta (sin conversión desde NumPy)
+_MES_SIN_COS = tuple(zip(_MES_SIN.tolist(), _MES_COS.tolist()))
+_MES_IDX = {m: i for i, m in enumerate(MESES)}
+
+def mes_index(mes: str) -> int:
+    return _MES_IDX.get((mes or "").strip().lower(), 0)
+
 def mes_to_sin_cos(mes: str):
-    m = (mes or "").strip().lower()
-    idx = MESES.index(m) if m in MESES else 0
-    ang = 2.0 * math.pi * (idx / 12.0)
-    return math.sin(ang), math.cos(ang)
+    return _MES_SIN_COS[mes_index(mes)]
 
 def safe_float(x, default=None):
     try:
@@ -70,15 +103,15 @@ def safe_float(x, default=None):
     except Exception:
         return default
 
-def clip01(x):
-    try:
-        return max(0.0, min(1.0, float(x)))
-    except Exception:
-        return 0.0
-
 # =========================
 # Inferencia de fase
 # =========================
+# Fase por (franja de altitud, mes) cuando no hay MDS; índices de FASES
+_FASE_POR_MES = (
+    (0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2),   # alt >= 1500: ene–abr vivero, may–ago floración, sep–dic cosecha
+    (0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 0),   # alt < 1500: dic–mar vivero, abr–jul floración, ago–nov cosecha
+)
+
 def inferir_fase(altitud: float, mes: str, mds: float | None) -> str:
     """
     Prioriza MDS (meses después de siembra):
@@ -98,24 +131,10 @@ def inferir_fase(altitud: float, mes: str, mds: float | None) -> str:
     except Exception:
         pass
 
-    m = (mes or "").strip().lower()
-    idx = MESES.index(m) if m in MESES else 0
+    idx = mes_index(mes)
     alt = float(altitud) if altitud is not None else 1650.0
 
-    if alt >= 1500:
-        if idx in [0,1,2,3]:
-            return "vivero_establecimiento"
-        elif idx in [4,5,6,7]:
-            return "floracion_llenado"
-        else:
-            return "cosecha_poscosecha"
-    else:
-        if idx in [11,0,1,2]:
-            return "vivero_establecimiento"
-        elif idx in [3,4,5,6]:
-            return "floracion_llenado"
-        else:
-            return "cosecha_poscosecha"
+    return FASES[_FASE_POR_MES[0 if alt >= 1500 else 1][idx]]
 
 def dominio_aplica(dominio: str, fase: str, mds: float | None):
     """
@@ -136,15 +155,76 @@ def dominio_aplica(dominio: str, fase: str, mds: float | None):
 # =========================
 # Cargar casos desde YAML
 # =========================
-def load_cases(paths):
+CACHE_SUFFIX = ".cbrcache.pkl"
+
+def _parse_yaml_file(pth: Path):
+    """
+    Parsea el YAML como bytes mapeados en memoria: el parser (libyaml) lee UTF-8 directamente,
+    sin la capa de decodificación de un archivo de texto. Si mmap no es posible
+    (archivo vacío, sistema de archivos sin soporte) se leen los bytes completos.
+    """
+    with open(pth, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return yaml.load(f.read(), Loader=_SafeLoader)
+        with mm:
+            return yaml.load(mm, Loader=_SafeLoader)
+
+def _read_yaml_with_sidecar(pth: Path, firma):
+    """
+    Lee un YAML usando un pickle junto al archivo (<nombre>.cbrcache.pkl) si su
+    firma (mtime_ns, size) coincide; si no, parsea el YAML y reescribe el pickle.
+    La firma va en un pickle propio al inicio: una caché vieja se descarta sin cargar los casos.
+    Solo para rutas de confianza (DEFAULT_DATA del API, CLI): pickle.load ejecuta lo que traiga
+    el archivo y la caché se escribe junto al YAML.
+    """
+    cache_path = pth.with_name(pth.name + CACHE_SUFFIX)
+    try:
+        with open(cache_path, "rb") as f:
+            if pickle.load(f) == firma:
+                return pickle.load(f)
+    except Exception:
+        pass
+
+    data = _parse_yaml_file(pth)
+    # Se escribe a un temporal y se reemplaza: otro proceso nunca lee un pickle a medias
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(firma, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"AVISO: no se pudo escribir la caché {cache_path}: {e}", file=sys.stderr)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return data
+
+@functools.lru_cache(maxsize=32)
+def _load_yaml_cached(path: str, mtime_ns: int, size: int, usar_sidecar: bool = False):
+    # mtime_ns y size forman parte de la clave: si el YAML cambia, la entrada deja de coincidir.
+    # El objeto devuelto se comparte entre llamadas y no debe modificarse.
+    if usar_sidecar:
+        return _read_yaml_with_sidecar(Path(path), (mtime_ns, size))
+    return _parse_yaml_file(Path(path))
+
+def load_cases(paths, usar_sidecar: bool = False):
+    """
+    Casos de los YAML `paths`. usar_sidecar=True (solo rutas de confianza) usa además la caché
+    pickle junto a cada archivo; rutas que llegan de un cliente se parsean sin leer ni escribir
+    nada más que el propio YAML (con la caché LRU en memoria).
+    """
     cases = []
     for p in paths:
         pth = Path(p)
         if not pth.exists():
             print(f"AVISO: no se encontró el archivo de casos: {pth}", file=sys.stderr)
             continue
-        with open(pth, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
+        st = pth.stat()
+        data = _load_yaml_cached(str(pth.resolve()), st.st_mtime_ns, st.st_size, usar_sidecar)
         if isinstance(data, list):
             cases.extend(data)
         else:
@@ -204,212 +284,340 @@ RANGES = {
     "edad_vivero_meses": (0.0, 6.0)
 }
 
-def norm01(val, key):
-    if val is None:
-        return None
-    lo, hi = RANGES[key]
-    if hi <= lo:
-        return 0.0
-    return clip01((val - lo) / (hi - lo))
-
-def sim_numeric(a, b, key):
-    if a is None or b is None:
-        return None
-    na = norm01(a, key)
-    nb = norm01(b, key)
-    if na is None or nb is None:
-        return None
-    return clip01(1.0 - abs(na - nb))
-
 # =========================
 # Fase lunar (categórica)
 # =========================
-ADYACENTES = {
-    "nueva": {"creciente"},
-    "creciente": {"nueva","llena"},
-    "llena": {"creciente","menguante"},
-    "menguante": {"llena"}
-}
-
-def sim_luna(a, b):
-    if not a or not b:
-        return None
-    a = a.strip().lower()
-    b = b.strip().lower()
-    if a == b:
-        return 1.0
-    if b in ADYACENTES.get(a, set()):
-        return 0.5
-    return 0.0
+LUNA_ID = {"nueva": 0, "creciente": 1, "llena": 2, "menguante": 3}
+LUNA_OTRA = 4  # texto no vacío que no corresponde a una fase conocida
+
+# LUNA_SIM[a, b]: misma fase -> 1.0, adyacente -> 0.5, resto (o fase no reconocida) -> 0.0
+LUNA_SIM = np.array([
+    [1.0, 0.5, 0.0, 0.0, 0.0],
+    [0.5, 1.0, 0.5, 0.0, 0.0],
+    [0.0, 0.5, 1.0, 0.5, 0.0],
+    [0.0, 0.0, 0.5, 1.0, 0.0],
+    [0.0, 0.0, 0.0, 0.0, 0.0]
+])
+
+def luna_id(fase):
+    """Codifica la fase lunar como 0..3 (LUNA_OTRA si no se reconoce); -1 si falta."""
+    if not fase:
+        return -1
+    return LUNA_ID.get(str(fase).strip().lower(), LUNA_OTRA)
 
 # =========================
-# Bono por estación (B)
+# Índice columnar (SoA) para A y B
 # =========================
-def station_bonus(query_alt, case_station, case_alt=None):
-    qa = safe_float(query_alt)
-    if qa is None:
-        return 1.0
-    ref = STATIONS_ALT.get(case_station, safe_float(case_alt))
-    if ref is None:
-        return 1.0
-    diff = abs(qa - ref)
-    if diff <= 60:
-        return 1.00
-    if diff <= 120:
-        return 0.85
-    if diff <= 200:
-        return 0.70
-    return 0.55
+# Rasgos numéricos (unión de A y B); cada bloque SoA usa un subconjunto de columnas
+FEATURES = ("temp_media", "humedad", "prec_total_mm", "dias_lluvia", "brillo_solar",
+            "altitud_msnm", "sombra_pct", "mes_sin", "mes_cos",
+            "meses_despues_siembra", "edad_vivero_meses")
+
+# Columnas de A (unión de los rasgos de todos los dominios) y de B, en el orden de FEATURES
+FEATURES_A = tuple(k for k in FEATURES if any(k in w for w in WEIGHTS.values()))
+FEATURES_B = tuple(k for k in FEATURES if k in WEIGHTS_B)
+
+# Ubicación de cada rasgo dentro de un caso: (sección, clave)
+CASE_FIELDS = {
+    "temp_media": ("clima", "temp_media"),
+    "humedad": ("clima", "humedad"),
+    "prec_total_mm": ("clima", "prec_total_mm"),
+    "dias_lluvia": ("clima", "dias_lluvia"),
+    "brillo_solar": ("clima", "brillo_solar"),
+    "altitud_msnm": ("contexto", "altitud_msnm"),
+    "sombra_pct": ("contexto", "sombra_pct"),
+    "meses_despues_siembra": ("fertilizacion_sin_suelo", "meses_despues_siembra")
+}
 
-# =========================
-# Vectores (entrada/caso)
-# =========================
-def extract_input_vector(args_dict):
-    mes_sin, mes_cos = mes_to_sin_cos(args_dict.get("mes"))
-    return {
-        "temp_media": safe_float(args_dict.get("temp_media")),
-        "humedad": safe_float(args_dict.get("humedad")),
-        "prec_total_mm": safe_float(args_dict.get("prec_total_mm")),
-        "dias_lluvia": safe_float(args_dict.get("dias_lluvia")),
-        "brillo_solar": safe_float(args_dict.get("brillo_solar")),
-        "altitud_msnm": safe_float(args_dict.get("altitud")),
-        "sombra_pct": safe_float(args_dict.get("sombra")),
-        "mes_sin": mes_sin, "mes_cos": mes_cos,
-        "meses_despues_siembra": safe_float(args_dict.get("meses_despues_siembra")),
-        "edad_vivero_meses": safe_float(args_dict.get("edad_vivero_meses")),
-        "luna_fase": args_dict.get("luna")
-    }
+# Parámetros de entrada cuyo nombre difiere del rasgo
+QUERY_FIELDS = {"altitud_msnm": "altitud", "sombra_pct": "sombra"}
+
+_FEAT_LO = np.array([RANGES[k][0] for k in FEATURES])
+_FEAT_SPAN = np.array([RANGES[k][1] - RANGES[k][0] for k in FEATURES])
+_FEAT_INV_RANGE = np.divide(1.0, _FEAT_SPAN, out=np.zeros_like(_FEAT_SPAN), where=_FEAT_SPAN > 0)
 
-def extract_case_vector_A(case):
-    ctx = case.get("contexto", {}) or {}
-    cli = case.get("clima", {}) or {}
-    mes_sin, mes_cos = mes_to_sin_cos(ctx.get("mes"))
+def norm01_features(raw):
+    """Normaliza a [0, 1] con RANGES, rasgo a rasgo, sobre (..., len(FEATURES))."""
+    return np.clip((raw - _FEAT_LO) * _FEAT_INV_RANGE, 0.0, 1.0)
 
+def _float_column(vals):
+    """
+    Columna de valores crudos -> float en una sola conversión de NumPy (None -> NaN).
+    Solo si hay valores no numéricos se recurre a safe_float valor por valor.
+    """
+    try:
+        return np.array(vals, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([safe_float(v) for v in vals], dtype=float)
+
+def _case_edad_vivero(case):
     evm = None
     if isinstance(case.get("almacigos_meta"), dict):
         evm = safe_float(case["almacigos_meta"].get("edad_vivero_meses"))
     if evm is None:
-        evm = safe_float(ctx.get("edad_vivero_meses"))
-
-    base = {
-        "temp_media": safe_float(cli.get("temp_media")),
-        "humedad": safe_float(cli.get("humedad")),
-        "prec_total_mm": safe_float(cli.get("prec_total_mm")),
-        "dias_lluvia": safe_float(cli.get("dias_lluvia")),
-        "brillo_solar": safe_float(cli.get("brillo_solar")),
-        "altitud_msnm": safe_float(ctx.get("altitud_msnm")),
-        "sombra_pct": safe_float(ctx.get("sombra_pct")),
-        "mes_sin": mes_sin, "mes_cos": mes_cos,
-        "meses_despues_siembra": safe_float((case.get("fertilizacion_sin_suelo") or {}).get("meses_despues_siembra")),
-        "edad_vivero_meses": evm,
-        "luna_fase": case.get("luna_fase")
-    }
-    return base
+        evm = safe_float((case.get("contexto") or {}).get("edad_vivero_meses"))
+    return evm
 
-def extract_case_vector_B(case):
-    ctx = case.get("contexto", {}) or {}
-    cli = case.get("clima", {}) or {}
-    mes_sin, mes_cos = mes_to_sin_cos(ctx.get("mes"))
+def case_matrix(cases, feats=FEATURES):
+    """
+    Extrae, columna por columna, los rasgos `feats` de una lista de casos.
+    Devuelve (N, len(feats)) con NaN donde falta el dato.
+    """
+    raw = np.empty((len(cases), len(feats)))
+    mes_idx = np.array([mes_index((c.get("contexto") or {}).get("mes")) for c in cases], dtype=np.intp)
+    for j, key in enumerate(feats):
+        if key == "mes_sin":
+            raw[:, j] = _MES_SIN[mes_idx]
+        elif key == "mes_cos":
+            raw[:, j] = _MES_COS[mes_idx]
+        elif key == "edad_vivero_meses":
+            raw[:, j] = np.array([_case_edad_vivero(c) for c in cases], dtype=float)
+        else:
+            sec, k = CASE_FIELDS[key]
+            raw[:, j] = _float_column([(c.get(sec) or {}).get(k) for c in cases])
+    return raw
+
+def _soa_block(grupos, feats, pesos):
+    """
+    Bloque SoA para casos agrupados (una lista de casos por dominio, con sus pesos en `pesos`):
+      - X: rasgos normalizados a [0, 1] (N, F); 0.0 donde falta el dato
+      - M: máscara de rasgos presentes (N, F)
+      - W: pesos de cada dominio (D, F); 0.0 si el rasgo no pertenece al dominio
+      - dom: dominio (0..D-1) de cada fila (N,)
+      - luna / w_luna: fase lunar codificada (N,), -1 si falta, y su peso por dominio (D,)
+      - cols: posición de cada columna dentro de FEATURES
+      - filas: slice de filas de cada grupo (las filas quedan contiguas por dominio)
+    """
+    cases = [c for g in grupos for c in g]
+    cols = np.array([FEATURES.index(k) for k in feats], dtype=np.intp)
+    raw = case_matrix(cases, feats)
+    M = ~np.isnan(raw)
+    X = np.clip((raw - _FEAT_LO[cols]) * _FEAT_INV_RANGE[cols], 0.0, 1.0)
+    tam = [len(g) for g in grupos]
+    limites = np.cumsum([0] + tam)
     return {
-        "estacion": ctx.get("estacion"),
-        "altitud_msnm": safe_float(ctx.get("altitud_msnm")),
-        "sombra_pct": safe_float(ctx.get("sombra_pct")),
-        "mes_sin": mes_sin, "mes_cos": mes_cos,
-        "temp_media": safe_float(cli.get("temp_media")),
-        "humedad": safe_float(cli.get("humedad")),
-        "prec_total_mm": safe_float(cli.get("prec_total_mm")),
-        "dias_lluvia": safe_float(cli.get("dias_lluvia")),
-        "brillo_solar": safe_float(cli.get("brillo_solar"))
+        "cases": cases,
+        "cols": cols,
+        "X": np.where(M, X, 0.0),
+        "M": M,
+        "W": np.array([[w.get(k, 0.0) for k in feats] for w in pesos]),
+        "dom": np.repeat(np.arange(len(grupos), dtype=np.int8), tam),
+        "luna": np.array([luna_id(c.get("luna_fase")) for c in cases], dtype=np.int8),
+        "w_luna": np.array([w.get("luna_fase", 0.0) for w in pesos]),
+        "filas": [slice(int(i), int(j)) for i, j in zip(limites[:-1], limites[1:])]
     }
 
+def build_soa_A(cases):
+    """
+    Materializa, una sola vez, los casos A en un único bloque SoA (ver _soa_block)
+    con las filas agrupadas por dominio en el orden de WEIGHTS;
+    soa["filas"][dominio] da el tramo de filas de cada dominio.
+    """
+    doms = list(WEIGHTS)
+    soa = _soa_block([[c for c in cases if c.get("tipo") == dom] for dom in doms],
+                     FEATURES_A, [WEIGHTS[dom] for dom in doms])
+    soa["filas"] = dict(zip(doms, soa["filas"]))
+    return soa
+
+def build_soa_B(cases):
+    """
+    Igual que build_soa_A para los históricos por estación (Dataset B), en un solo grupo.
+    El filtro de casos B se aplica aquí, una sola vez. 'ref_alt' guarda la altitud de
+    referencia del bono por estación (la de STATIONS_ALT o la del caso; NaN si no hay,
+    marcado en 'sin_ref').
+    """
+    cases_B = [c for c in cases
+               if c.get("tipo") == "historico" or (c.get("contexto") or {}).get("estacion")]
+    soa = _soa_block([cases_B], FEATURES_B, [WEIGHTS_B])
+    ctxs = [c.get("contexto") or {} for c in cases_B]
+    soa["ref_alt"] = _float_column(
+        [STATIONS_ALT.get(ctx.get("estacion"), ctx.get("altitud_msnm")) for ctx in ctxs]
+    )
+    soa["sin_ref"] = np.isnan(soa["ref_alt"])
+    return soa
+
+def pack_query(params):
+    """
+    Vector de consulta sobre FEATURES: (normalizado, máscara de presencia, fase lunar codificada).
+    Se arma una vez por consulta y sirve para todos los bloques SoA (A y B).
+    """
+    raw = np.empty(len(FEATURES))
+    msin, mcos = mes_to_sin_cos(params.get("mes"))
+    for j, key in enumerate(FEATURES):
+        if key == "mes_sin":
+            v = msin
+        elif key == "mes_cos":
+            v = mcos
+        else:
+            v = safe_float(params.get(QUERY_FIELDS.get(key, key)))
+        raw[j] = np.nan if v is None else v
+    qm = ~np.isnan(raw)
+    return np.where(qm, norm01_features(raw), 0.0), qm, luna_id(params.get("luna"))
+
 # =========================
 # Similitud ponderada
 # =========================
-def similarity_weighted_A(qvec, cvec, domain):
-    weights = WEIGHTS[domain]
-    s_num = 0.0
-    s_den = 0.0
-    for k, w in weights.items():
-        if qvec.get(k) is None:
-            continue
-        if k == "luna_fase":
-            simk = sim_luna(qvec["luna_fase"], cvec.get("luna_fase"))
-        else:
-            simk = sim_numeric(qvec.get(k), cvec.get(k), k)
-        if simk is None:
-            continue
-        s_num += w * clip01(simk)
-        s_den += w
-    return 0.0 if s_den <= 0 else clip01(s_num / s_den)
-
-def similarity_weighted_B(qvec, cvec, query_alt):
-    s_num = 0.0
-    s_den = 0.0
-    for k, w in WEIGHTS_B.items():
-        if qvec.get(k) is None:
-            continue
-        simk = sim_numeric(qvec.get(k), cvec.get(k), k)
-        if simk is None:
-            continue
-        s_num += w * clip01(simk)
-        s_den += w
-    base = 0.0 if s_den <= 0 else clip01(s_num / s_den)
-    bonus = station_bonus(query_alt, cvec.get("estacion"), cvec.get("altitud_msnm"))
-    return clip01(base * bonus)
+def _score_numpy(X, M, W, dom, qn, qm, luna, q_luna, w_luna, luna_sim):
+    w_eff = M * (W[dom] * qm)
+    d = 1.0 - np.abs(X - qn)
+    num = (d * w_eff).sum(axis=1)
+    den = w_eff.sum(axis=1)
+    if q_luna >= 0:
+        wl = w_luna[dom] * (luna >= 0)
+        num += wl * luna_sim[q_luna, np.maximum(luna, 0)]
+        den += wl
+    s = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+    return np.clip(s, 0.0, 1.0)
+
+def _score_loop(X, M, W, dom, qn, qm, luna, q_luna, w_luna, luna_sim):
+    n, f = X.shape
+    out = np.empty(n)
+    for i in range(n):
+        d = dom[i]
+        num = 0.0
+        den = 0.0
+        for j in range(f):
+            if qm[j] and M[i, j]:
+                num += W[d, j] * (1.0 - abs(X[i, j] - qn[j]))
+                den += W[d, j]
+        if w_luna[d] > 0.0 and q_luna >= 0 and luna[i] >= 0:
+            num += w_luna[d] * luna_sim[q_luna, luna[i]]
+            den += w_luna[d]
+        s = num / den if den > 0.0 else 0.0
+        out[i] = min(1.0, max(0.0, s))
+    return out
+
+# Firma explícita: Numba compila al importar (y cachea en __pycache__), no en la primera consulta.
+_score_numba = None if njit is None else njit(
+    "f8[::1](f8[:,::1], b1[:,::1], f8[:,::1], i1[::1], f8[::1], b1[::1], i1[::1], i8, f8[::1], f8[:,::1])",
+    fastmath=True, cache=True, nogil=True
+)(_score_loop)
+
+# Bloques grandes se reparten por tramos de filas entre hilos: NumPy y el kernel Numba (nogil)
+# liberan el GIL. Por debajo del umbral el costo de coordinar hilos supera la ganancia.
+PARALELO_MIN_FILAS = 50_000
+PARALELO_HILOS = min(4, len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1))
+# El pool se crea recién con el primer bloque grande (con los YAML incluidos no ocurre);
+# el candado evita que peticiones concurrentes del API creen más de uno.
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ThreadPoolExecutor(max_workers=PARALELO_HILOS, thread_name_prefix="cbr")
+    return _POOL
+
+def cerrar_pool():
+    """Cierra el pool de puntaje si llegó a crearse (al salir del proceso o al apagar el API)."""
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+atexit.register(cerrar_pool)
+
+def score_cases(soa, query, filas=slice(None)):
+    """
+    Similitud ponderada de la consulta contra las filas `filas` del bloque SoA a la vez,
+    cada fila con los pesos de su dominio.
+    Por rasgo: 1 - |caso - consulta| normalizados; luna con LUNA_SIM. Solo cuentan (y se
+    renormalizan) los pesos de rasgos presentes en la consulta y en el caso.
+    Usa el kernel compilado con Numba si está disponible; si no, NumPy vectorizado.
+    Con PARALELO_MIN_FILAS filas o más, el cálculo se reparte en PARALELO_HILOS hilos.
+    """
+    qn, qm, q_luna = query
+    cols = soa["cols"]
+    kernel = _score_numba or _score_numpy
+    X, M, dom, luna = soa["X"][filas], soa["M"][filas], soa["dom"][filas], soa["luna"][filas]
+    q = (qn[cols], qm[cols])
+    n = X.shape[0]
+    if n < PARALELO_MIN_FILAS or PARALELO_HILOS < 2:
+        return kernel(X, M, soa["W"], dom, *q, luna, int(q_luna), soa["w_luna"], LUNA_SIM)
+
+    # Los tramos de filas son vistas contiguas del bloque; cada hilo puntúa el suyo
+    limites = np.linspace(0, n, PARALELO_HILOS + 1).astype(int)
+    futuros = [
+        _pool().submit(kernel, X[a:b], M[a:b], soa["W"], dom[a:b], *q, luna[a:b],
+                       int(q_luna), soa["w_luna"], LUNA_SIM)
+        for a, b in zip(limites[:-1], limites[1:])
+    ]
+    return np.concatenate([f.result() for f in futuros])
+
+def top_k_indices(scores, k):
+    """
+    Índices de los k mayores puntajes, de mayor a menor, sin ordenar todo el arreglo.
+    Los empates se resuelven por orden de aparición (igual que un sort estable).
+    """
+    n = scores.size
+    k = min(max(1, k), n)
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        cand = np.flatnonzero(scores >= kth)
+    else:
+        cand = np.arange(n)
+    order = np.lexsort((cand, -scores[cand]))[:k]
+    return cand[order]
 
 # =========================
 # Recuperación (k-NN)
 # =========================
-def top_k_A(cases, query_vec, domain, k, fase_actual, mds):
+def top_k_A_multi(soa, query, dominios, k, fase_actual, mds):
     """
-    Si el dominio no aplica en la fase actual:
+    Recupera los k casos más similares de cada dominio con un solo barrido del índice
+    SoA (build_soa_A): se puntúa de una vez el tramo de filas que cubre a los dominios
+    aplicables y luego se seleccionan los k de cada uno.
+    Si un dominio no aplica en la fase actual:
       - no se recuperan casos (lista vacía),
       - se devuelve la razón en el meta.
+    Devuelve {dominio: (hits, meta)}.
     """
-    aplica, razon = dominio_aplica(domain, fase_actual, mds)
+    res = {}
+    filas = {}
+    for dom in dominios:
+        aplica, razon = dominio_aplica(dom, fase_actual, mds)
+        if aplica:
+            filas[dom] = soa["filas"][dom]
+        else:
+            res[dom] = ([], {"aplica": False, "razon_no_aplica": razon})
 
-    if not aplica:
-        meta = {"aplica": False, "razon_no_aplica": razon}
-        return [], meta
+    if filas:
+        ini = min(f.start for f in filas.values())
+        fin = max(f.stop for f in filas.values())
+        scores = score_cases(soa, query, slice(ini, fin))
+        for dom, f in filas.items():
+            s_dom = scores[f.start - ini:f.stop - ini]
+            hits = [(float(s_dom[i]), soa["cases"][f.start + i]) for i in top_k_indices(s_dom, k)]
+            res[dom] = (hits, {"aplica": True, "razon_no_aplica": None})
 
-    hits = []
-    for c in cases:
-        if c.get("tipo") != domain:
-            continue
-        sv = extract_case_vector_A(c)
-        s = similarity_weighted_A(query_vec, sv, domain)
-        hits.append((s, c))
+    return {dom: res[dom] for dom in dominios}
 
-    hits.sort(key=lambda x: x[0], reverse=True)
-    meta = {"aplica": True, "razon_no_aplica": None}
-    return hits[:max(1, k)], meta
+def top_k_A(soa, query, domain, k, fase_actual, mds):
+    """top_k_A_multi para un solo dominio: devuelve (hits, meta)."""
+    return top_k_A_multi(soa, query, [domain], k, fase_actual, mds)[domain]
 
-def extras_from_B(cases, query_context, kB):
+def extras_from_B(soa_B, query, query_alt, kB):
     """
-    Recupera vecinos históricos (Dataset B) y devuelve una lista de 'extras':
+    Recupera vecinos históricos (Dataset B, índice de build_soa_B) para la consulta
+    empaquetada (pack_query) y devuelve una lista de 'extras':
     cada extra tiene: texto, categoria_b, estacion, similitud, id_caso.
     """
-    msin, mcos = mes_to_sin_cos(query_context.get("mes"))
-    qvec = {
-        "temp_media": query_context.get("temp_media"),
-        "humedad": query_context.get("humedad"),
-        "prec_total_mm": query_context.get("prec_total_mm"),
-        "dias_lluvia": query_context.get("dias_lluvia"),
-        "brillo_solar": query_context.get("brillo_solar"),
-        "altitud_msnm": query_context.get("altitud"),
-        "sombra_pct": query_context.get("sombra"),
-        "mes_sin": msin, "mes_cos": mcos
-    }
-    scored = []
-    for c in cases:
-        ctx = c.get("contexto") or {}
-        if not (c.get("tipo") == "historico" or ctx.get("estacion")):
-            continue
-        sv = extract_case_vector_B(c)
-        s = similarity_weighted_B(qvec, sv, query_context.get("altitud"))
-        scored.append((s, c))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top = scored[:max(1, kB)]
+    # score_cases devuelve un arreglo nuevo: el bono y el recorte se aplican sobre él, sin copias
+    scores = score_cases(soa_B, query)
+    qa = safe_float(query_alt)
+    if qa is not None:
+        # Bono por estación, por tramos de |altitud - altitud de referencia| sobre todo el bloque;
+        # sin altitud de referencia -> 1.0
+        diff = np.abs(qa - soa_B["ref_alt"])
+        scores *= np.select([soa_B["sin_ref"], diff <= 60, diff <= 120, diff <= 200],
+                            [1.0, 1.00, 0.85, 0.70], default=0.55)
+    np.clip(scores, 0.0, 1.0, out=scores)
+    top = [(float(scores[i]), soa_B["cases"][i]) for i in top_k_indices(scores, kB)]
     extras = []
     for s, c in top:
         recs = (c.get("recomendaciones") or {})
@@ -432,22 +640,16 @@ def extras_from_B(cases, query_context, kB):
 
 COMPONENTES_FERT = ["urea", "DAP", "KCl", "NPK", "MgO"]
 
+# Compilados una vez: un solo barrido por texto detecta todos los componentes
+_COMPS_RE = re.compile("|".join(COMPONENTES_FERT), re.IGNORECASE)
+_MDS_RE = re.compile(r"(?:≤\s*)?(\d+)\s*MDS")
+
 def extraer_mds_de_texto(txt: str) -> float | None:
-    txt = txt or ""
-    m = re.search(r'(\d+)\s*MDS', txt)
-    if m:
-        return float(m.group(1))
-    m = re.search(r'≤\s*(\d+)\s*MDS', txt)
-    if m:
-        return float(m.group(1))
-    return None
+    m = _MDS_RE.search(txt or "")
+    return float(m.group(1)) if m else None
 
 def extraer_componentes(txt: str) -> list[str]:
-    comps = []
-    for comp in COMPONENTES_FERT:
-        if re.search(comp, txt, re.IGNORECASE):
-            comps.append(comp.lower())
-    return comps
+    return list(dict.fromkeys(m.lower() for m in _COMPS_RE.findall(txt)))
 
 def combinar_recs_fertilizacion(hits_fert, mds_query: float | None):
     """
@@ -492,25 +694,20 @@ def combinar_recs_genericas(hits_dom):
     Combina recomendaciones técnicas y tradicionales de k (Dataset A),
     eliminando repeticiones textuales.
     """
-    tecnicas = []
-    tradicionales = []
-    seen_t = set()
-    seen_trad = set()
-
+    # dict como conjunto ordenado: conserva el orden de aparición con una sola búsqueda por texto
+    tecnicas, tradicionales = {}, {}
     for sim, case in hits_dom:
         rec = case.get("recomendaciones") or {}
-        for t in rec.get("tecnicas") or []:
+        for t in rec.get("tecnicas") or ():
             t = (t or "").strip()
-            if t and t not in seen_t:
-                seen_t.add(t)
-                tecnicas.append(t)
-        for tr in rec.get("tradicionales") or []:
+            if t:
+                tecnicas[t] = None
+        for tr in rec.get("tradicionales") or ():
             tr = (tr or "").strip()
-            if tr and tr not in seen_trad:
-                seen_trad.add(tr)
-                tradicionales.append(tr)
+            if tr:
+                tradicionales[tr] = None
 
-    return {"tecnicas": tecnicas, "tradicionales": tradicionales}
+    return {"tecnicas": list(tecnicas), "tradicionales": list(tradicionales)}
 
 # =========================
 # Combinación aparte para kB (extras_B)
@@ -526,39 +723,106 @@ def agrupar_extras_B(extras_B):
         txt = (e.get("texto") or "").strip()
         if not txt:
             continue
-        if cat not in grupos:
-            grupos[cat] = []
-        if txt not in grupos[cat]:
-            grupos[cat].append(txt)
-    return grupos
+        grupos.setdefault(cat, {})[txt] = None
+    return {cat: list(textos) for cat, textos in grupos.items()}
 
 # =========================
 # Retención (Dataset C)
 # =========================
-def append_case_to_yaml(save_path: Path, new_case: dict) -> str:
-    cases_existing = []
-    if save_path.exists():
-        try:
-            with open(save_path, "r", encoding="utf-8") as f:
-                data = yaml.safe_load(f)
-                if isinstance(data, list):
-                    cases_existing = data
-        except Exception:
-            pass
-    next_id = len(cases_existing) + 1
-    new_case["id"] = f"NEW-{next_id:04d}"
-    cases_existing.append(new_case)
-    with open(save_path, "w", encoding="utf-8") as f:
-        yaml.safe_dump(cases_existing, f, allow_unicode=True, sort_keys=False)
+def _leer_casos_existentes(save_path: Path):
+    """
+    Lee el YAML de casos completo (una sola vez, sin '.count' confiable).
+    Devuelve (casos, se_puede_anexar): se puede anexar solo si el archivo es un único documento
+    con una lista en bloque en la columna 0 que termina en salto de línea; si no, hay que reescribirlo.
+    Varios documentos ('---') se juntan en una sola lista; lo que no sea lista ni caso se descarta.
+    """
+    try:
+        texto = save_path.read_text(encoding="utf-8")
+        nodos = list(yaml.compose_all(texto, Loader=_SafeLoader))
+        docs = list(yaml.load_all(texto, Loader=_SafeLoader))
+    except Exception:
+        return [], False
+    casos = []
+    for d in docs:
+        if isinstance(d, list):
+            casos.extend(d)
+        elif isinstance(d, dict):
+            casos.append(d)
+    en_bloque = (
+        len(nodos) == 1 and isinstance(nodos[0], yaml.SequenceNode)
+        and not nodos[0].flow_style and nodos[0].start_mark.column == 0
+        and texto.endswith("\n") and not texto.rstrip().endswith("...")
+    )
+    return casos, en_bloque
+
+def _firma_archivo(pth: Path) -> str:
+    st = pth.stat()
+    return f"{st.st_size} {st.st_mtime_ns}"
+
+def append_case_to_yaml(save_path: Path, new_case: dict, reescribir: bool = False) -> str:
+    """
+    Agrega el caso al final del YAML (lista de casos en bloque) sin releer ni reescribir el archivo.
+    '<archivo>.count' guarda el número de casos y la firma (tamaño, mtime_ns) del YAML tras la
+    última escritura. Si falta o no coincide (archivo previo, editado a mano), el YAML se lee una
+    vez: si es una lista en bloque que termina en salto de línea se sigue anexando; si no (flujo,
+    mapeo, varios documentos, sin salto final) se reescribe completo como lista en bloque.
+    reescribir=True (--rewrite) fuerza esa reescritura (migración).
+    Un flock sobre el '.count' serializa escritores concurrentes (varios workers).
+    """
+    count_path = save_path.with_name(save_path.name + ".count")
+    with open(count_path, "a+", encoding="utf-8") as cf:
+        if fcntl is not None:
+            fcntl.flock(cf, fcntl.LOCK_EX)
+        cf.seek(0)
+        guardado = cf.read().split(" ", 1)
+        existentes = None
+        if not save_path.exists():
+            n = 0
+        elif (not reescribir and len(guardado) == 2 and guardado[0].isdigit()
+              and guardado[1].strip() == _firma_archivo(save_path)):
+            n = int(guardado[0])
+        else:
+            casos, en_bloque = _leer_casos_existentes(save_path)
+            n = len(casos)
+            if reescribir or not en_bloque:
+                existentes = casos
+
+        new_case["id"] = f"NEW-{n + 1:04d}"
+        if existentes is None and n > 0:
+            # Una lista de un elemento se serializa como '- ...': añadida al final sigue siendo la misma lista
+            with open(save_path, "a", encoding="utf-8") as f:
+                yaml.dump([new_case], f, Dumper=_SafeDumper, allow_unicode=True, sort_keys=False)
+        else:
+            with open(save_path, "w", encoding="utf-8") as f:
+                yaml.dump((existentes or []) + [new_case], f, Dumper=_SafeDumper,
+                          allow_unicode=True, sort_keys=False)
+
+        cf.seek(0)
+        cf.truncate()
+        cf.write(f"{n + 1} {_firma_archivo(save_path)}")
     return new_case["id"]
 
 # =========================
 # Ejecución principal
 # =========================
-def run_cbr(params, verbose: bool = True):
-    # Cargar casos A+B
-    cases = load_cases(params["data"])
-    if not cases:
+@dataclass(frozen=True)
+class CBRIndex:
+    """
+    Casos A+B ya cargados y sus arreglos SoA (A por dominio y B).
+    Se construye una vez (build_index) y se reutiliza en cada consulta (query_index).
+    """
+    paths: tuple
+    cases: list
+    A: dict
+    B: dict
+
+def build_index(paths, usar_sidecar: bool = False) -> CBRIndex:
+    # usar_sidecar: ver load_cases; solo para rutas de confianza
+    cases = load_cases(paths, usar_sidecar=usar_sidecar)
+    return CBRIndex(paths=tuple(paths), cases=cases, A=build_soa_A(cases), B=build_soa_B(cases))
+
+def query_index(index: CBRIndex, params, verbose: bool = True):
+    if not index.cases:
         print("No se cargaron casos desde los YAML indicados.", file=sys.stderr)
         return None
 
@@ -570,15 +834,14 @@ def run_cbr(params, verbose: bool = True):
     )
     mds = params.get("meses_despues_siembra")
 
-    query_vec = extract_input_vector(params)
+    query = pack_query(params)
 
     dominios = ["almacigos","fertilizacion_sin_analisis","broca"] if params["tipo"] == "auto" else [params["tipo"]]
 
     # 1) Recuperación k (Dataset A)
     hits_por_dom = {}
     meta_por_dom = {}
-    for dom in dominios:
-        klist, meta = top_k_A(cases, query_vec, dom, params["k"], fase_actual, mds)
+    for dom, (klist, meta) in top_k_A_multi(index.A, query, dominios, params["k"], fase_actual, mds).items():
         hits_por_dom[dom] = klist
         meta_por_dom[dom] = meta
 
@@ -586,7 +849,7 @@ def run_cbr(params, verbose: bool = True):
     extras = []
     extras_agrupados = {}
     if params.get("usar_extras_b", True):
-        extras, _ = extras_from_B(cases, params, params["kB"])
+        extras, _ = extras_from_B(index.B, query, params.get("altitud"), params["kB"])
         extras_agrupados = agrupar_extras_B(extras)
 
     # 3) Fusión de recomendaciones SOLO con k (A), por dominio
@@ -662,7 +925,7 @@ def run_cbr(params, verbose: bool = True):
         }
         try:
             save_path = Path(params["save_case_to"])
-            saved_id = append_case_to_yaml(save_path, out_case)
+            saved_id = append_case_to_yaml(save_path, out_case, reescribir=bool(params.get("rewrite")))
         except Exception as e:
             print(f"AVISO: no se pudo guardar el caso en '{params['save_case_to']}': {e}", file=sys.stderr)
 
@@ -708,7 +971,6 @@ def run_cbr(params, verbose: bool = True):
 
         if saved_id:
             print(f"\nNuevo caso guardado con ID: {saved_id} en '{params['save_case_to']}'")
-        print(json.dumps(output, ensure_ascii=False, indent=2))
 
     output = {
         "consulta": {
@@ -723,13 +985,46 @@ def run_cbr(params, verbose: bool = True):
     }
     return output
 
+def run_cbr(params, verbose: bool = True):
+    """Carga los casos de params["data"] y ejecuta la consulta (uso CLI / puntual)."""
+    # Uso local (CLI): las rutas las elige quien ejecuta el script, se permite la caché pickle
+    return query_index(build_index(params["data"], usar_sidecar=True), params, verbose=verbose)
+
 
 # =========================
 # CLI / PRUEBA
 # =========================
+def _strtobool(v):
+    return (v or "true").strip().lower() in ("true","1","yes","y","si")
+
+# Parámetros del modo PRUEBA (solo lectura: query_index no modifica params)
+_DEFAULT_PARAMS = types.MappingProxyType({
+    "data": ("CBR_Cafe_Cauca_A.yaml", "CBR_Cafe_Cauca_B_historicos.yaml"),
+    "tipo": "auto",
+    "ubicacion": "Popayan",
+    "altitud": 1678,
+    "mes": "noviembre",
+    "variedad": "Castillo",
+    "sombra": 25,
+    "temp_media": 17.6,
+    "humedad": 97,
+    "prec_total_mm": 192.2,
+    "dias_lluvia": 18,
+    "brillo_solar": 95,
+    "meses_despues_siembra": 10,
+    "edad_vivero_meses": 3,
+    "luna": "creciente",
+    "fase": "vivero_establecimiento",
+    "k": 3,
+    "kB": 1,
+    "usar_extras_b": True,
+    "save_case_to": "CBR_Cafe_Cauca_C.yaml"
+})
+
 def parse_args_or_defaults():
     if len(sys.argv) > 1:
-        ap = argparse.ArgumentParser()
+        # fromfile_prefix_chars: los argumentos también pueden venir de un archivo (@params.txt)
+        ap = argparse.ArgumentParser(fromfile_prefix_chars="@")
         ap.add_argument("--data", nargs="+", required=True, help="YAML con casos (A y/o B; listas).")
         ap.add_argument("--tipo", choices=["auto","almacigos","fertilizacion_sin_analisis","broca"], default="auto")
         ap.add_argument("--ubicacion", default=None)
@@ -752,56 +1047,15 @@ def parse_args_or_defaults():
                         help="Fase fenológica actual; si no se pasa, se infiere.")
         ap.add_argument("--k", type=int, default=5, help="Vecinos para A.")
         ap.add_argument("--kB", type=int, default=5, help="Vecinos para B (extras).")
-        ap.add_argument("--usar_extras_b", type=str, default="true",
+        ap.add_argument("--usar_extras_b", type=_strtobool, default=True,
                         help="true/false: agregar extras del histórico B.")
         ap.add_argument("--save_case_to", default=None, help="Ruta YAML para guardar nuevo caso (Dataset C).")
-        args = ap.parse_args()
-        return {
-            "data": args.data,
-            "tipo": args.tipo,
-            "ubicacion": args.ubicacion,
-            "altitud": args.altitud,
-            "mes": args.mes,
-            "variedad": args.variedad,
-            "sombra": args.sombra,
-            "temp_media": args.temp_media,
-            "humedad": args.humedad,
-            "prec_total_mm": args.prec_total_mm,
-            "dias_lluvia": args.dias_lluvia,
-            "brillo_solar": args.brillo_solar,
-            "meses_despues_siembra": args.meses_despues_siembra,
-            "edad_vivero_meses": args.edad_vivero_meses,
-            "luna": args.luna,
-            "fase": args.fase,
-            "k": args.k,
-            "kB": args.kB,
-            "usar_extras_b": (args.usar_extras_b or "true").strip().lower() in ("true","1","yes","y","si"),
-            "save_case_to": args.save_case_to
-        }
+        ap.add_argument("--rewrite", action="store_true",
+                        help="Reescribe el YAML de --save_case_to como una sola lista en bloque (migración).")
+        return vars(ap.parse_args())
     else:
         print("Modo PRUEBA: ejecutando con parámetros por defecto (sin CLI).")
-        return {
-            "data": ["CBR_Cafe_Cauca_A.yaml", "CBR_Cafe_Cauca_B_historicos.yaml"],
-            "tipo": "auto",
-            "ubicacion": "Popayan",
-            "altitud": 1678,
-            "mes": "noviembre",
-            "variedad": "Castillo",
-            "sombra": 25,
-            "temp_media": 17.6,
-            "humedad": 97,
-            "prec_total_mm": 192.2,
-            "dias_lluvia": 18,
-            "brillo_solar": 95,
-            "meses_despues_siembra": 10,
-            "edad_vivero_meses": 3,
-            "luna": "creciente",
-            "fase": "vivero_establecimiento",
-            "k": 3,
-            "kB": 1,
-            "usar_extras_b": True,
-            "save_case_to": "CBR_Cafe_Cauca_C.yaml"
-        }
+        return _DEFAULT_PARAMS
 
 if __name__ == "__main__":
     params = parse_args_or_defaults()
@@ -14,20 +14,44 @@ Generador: Dataset A
     - grafico_validacion.png
 """
 
+import csv
+import functools
 import math
-import random
+import os
+import multiprocessing as mp
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import yaml
 import re
 
+# Emisor YAML en C (libyaml); sin él se usa el de Python puro, bastante más lento para 3000 casos
+try:
+    from yaml import CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeDumper as _YamlDumper
+    print("AVISO: PyYAML sin libyaml; la escritura del YAML será más lenta.")
+
+class SafeDumper(_YamlDumper):
+    """
+    Dumper seguro que memoriza la etiqueta implícita de cada escalar: los casos repiten los mismos
+    textos y valores miles de veces y el resolver probaría sus expresiones regulares en cada uno.
+    La etiqueta depende solo de (valor, implicit) porque el dumper seguro no tiene resolvers por ruta.
+    """
+    _etiquetas = {}
+
+    def resolve(self, kind, value, implicit):
+        if kind is not yaml.ScalarNode:
+            return super().resolve(kind, value, implicit)
+        clave = (value, implicit)
+        tag = self._etiquetas.get(clave)
+        if tag is None:
+            tag = self._etiquetas[clave] = super().resolve(kind, value, implicit)
+        return tag
+
 # *************** Configuración
 
-random.seed(42)
-np.random.seed(42)
+rng = np.random.default_rng(42)   # todos los sorteos (contexto, clima, valores por dominio y mezcla final)
 
 OUT_YAML = "CBR_Cafe_Cauca_A.yaml"
 OUT_CSV  = "CBR_Cafe_Cauca_A_preview.csv"
@@ -38,60 +62,79 @@ N_ALMACIGOS = 1000
 N_FERT      = 1000
 N_BROCA     = 1000
 
-MUNICIPIOS = [
+# Armado + serialización en paralelo (procesos); lotes pequeños no compensan el costo de arrancarlos.
+# Se cuentan las CPUs asignadas al proceso (contenedores/taskset), no todas las de la máquina.
+N_PROCESOS = min(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1), 8)
+CASOS_POR_LOTE = 250
+MIN_CASOS_PARALELO = 1000
+
+MUNICIPIOS = (
     "Popayan","Santander de Quilichao","Piendamo","Cajibio","El Tambo","Morales","Totoro","Silvia",
     "Sotara","Timbio","Patia","Buenos Aires","Bolivar","Almaguer","Argelia","La Sierra","Rosas",
     "Sucre","Paez","Jambalo","Caldono","Inza","Toribio","Purace"
-]
-MESES = ["enero","febrero","marzo","abril","mayo","junio","julio","agosto","septiembre","octubre","noviembre","diciembre"]
-VARIEDADES = ["Castillo","Caturra","Colombia","Tabi"]
-LUNAS = ["nueva","creciente","llena","menguante"]
+)
+MESES = ("enero","febrero","marzo","abril","mayo","junio","julio","agosto","septiembre","octubre","noviembre","diciembre")
+MES_IDX = {m: i for i, m in enumerate(MESES)}
+VARIEDADES = ("Castillo","Caturra","Colombia","Tabi")
+LUNAS = ("nueva","creciente","llena","menguante")
+
+# Una sola instancia por texto repetido (recomendaciones, fuentes): los 3000 casos
+# comparten los objetos str en vez de guardar una copia cada uno
+_CANONICAL = {}
+
+def _c(s):
+    return _CANONICAL.setdefault(s, s)
 
 
 # *************** Utilidades climáticas (Cauca)
 
-def pick_altitud():
+# Términos estacionales por índice de mes (se calculan una sola vez)
+SIN_TEMP  = np.array([math.sin((i/12.0)*2*math.pi - math.pi/6) for i in range(12)])
+SIN_RAIN1 = np.array([math.sin((i/12.0)*2*math.pi - math.pi/3) for i in range(12)])
+SIN_RAIN2 = np.array([math.sin((i/12.0)*4*math.pi - math.pi/4) for i in range(12)])
+SIN_RH    = np.array([math.sin((i/12.0)*2*math.pi + math.pi/3) for i in range(12)])
+
+# Las utilidades trabajan sobre arreglos: un caso por posición, un solo sorteo por término de ruido
+
+def pick_altitud(n):
     # altitudes cafeteras típicas del Cauca
-    return int(np.clip(np.random.normal(1650, 220), 1200, 2100))
+    return np.clip(rng.normal(1650, 220, n), 1200, 2100).astype(int)
 
-def temp_media_from_altitud(alt_m, mes):
+def temp_media_from_altitud(alt_m, mes_idx):
     base = 27.0 - 0.006 * alt_m
-    idx = MESES.index(mes)
-    seasonal = 1.1 * math.sin((idx/12.0)*2*math.pi - math.pi/6)
-    t = base + seasonal + np.random.normal(0, 0.5)
-    return float(np.clip(round(t, 1), 12.0, 26.5))
-
-def precip_from_month_alt(mes, alt_m):
-    idx = MESES.index(mes)
-    rain = 120 + 60*math.sin((idx/12.0)*2*math.pi - math.pi/3) \
-               + 60*math.sin((idx/12.0)*4*math.pi - math.pi/4)
+    seasonal = 1.1 * np.take(SIN_TEMP, mes_idx)
+    t = base + seasonal + rng.normal(0, 0.5, len(alt_m))
+    return np.clip(np.round(t, 1), 12.0, 26.5)
+
+def precip_from_month_alt(mes_idx, alt_m):
+    rain = 120 + 60*np.take(SIN_RAIN1, mes_idx) + 60*np.take(SIN_RAIN2, mes_idx)
     rain += (alt_m - 1400)/10.0
-    rain += np.random.normal(0, 20)
-    return float(np.clip(round(rain, 1), 40, 260))
+    rain += rng.normal(0, 20, len(alt_m))
+    return np.clip(np.round(rain, 1), 40, 260)
 
-def humedad_from_precip(prec, mes):
-    idx = MESES.index(mes)
+def humedad_from_precip(prec, mes_idx):
     base = 60 + (prec/3.5)
-    seasonal = 2.5 * math.sin((idx/12.0)*2*math.pi + math.pi/3)
-    val = base + seasonal + np.random.normal(0, 3.5)
-    return float(np.clip(round(val, 1), 55, 95))
+    seasonal = 2.5 * np.take(SIN_RH, mes_idx)
+    val = base + seasonal + rng.normal(0, 3.5, len(prec))
+    return np.clip(np.round(val, 1), 55, 95)
 
 def dias_lluvia_from_precip(prec):
-    return int(np.clip(round(prec/10.0 + np.random.normal(0, 2)), 5, 25))
+    return np.clip(np.rint(prec/10.0 + rng.normal(0, 2, len(prec))), 5, 25).astype(int)
 
 def brillo_from_precip(prec):
-    v = 7.5 - (prec - 80)/65.0 + np.random.normal(0, 0.35)
-    return float(np.clip(round(v, 1), 3.5, 8.0))
+    v = 7.5 - (prec - 80)/65.0 + rng.normal(0, 0.35, len(prec))
+    return np.clip(np.round(v, 1), 3.5, 8.0)
 
 def temp_extremes(tmed):
-    tmax = tmed + np.random.uniform(5.0, 8.0)
-    tmin = tmed - np.random.uniform(4.0, 6.0)
-    return float(round(np.clip(tmin, 8, 22), 1)), float(round(np.clip(tmax, 18, 35), 1))
-
-def build_clima(alt, mes):
-    p = precip_from_month_alt(mes, alt)
-    tmed = temp_media_from_altitud(alt, mes)
-    rh = humedad_from_precip(p, mes)
+    tmax = tmed + rng.uniform(5.0, 8.0, len(tmed))
+    tmin = tmed - rng.uniform(4.0, 6.0, len(tmed))
+    return np.round(np.clip(tmin, 8, 22), 1), np.round(np.clip(tmax, 18, 35), 1)
+
+def build_clima_batch(alts, mes_idx):
+    """Clima de len(alts) casos como columnas (arreglos NumPy)."""
+    p = precip_from_month_alt(mes_idx, alts)
+    tmed = temp_media_from_altitud(alts, mes_idx)
+    rh = humedad_from_precip(p, mes_idx)
     tmin, tmax = temp_extremes(tmed)
     brillo = brillo_from_precip(p)
     d = dias_lluvia_from_precip(p)
@@ -103,6 +146,7 @@ def build_clima(alt, mes):
 
 # *************** Fase fenológica 
 
+@functools.lru_cache(maxsize=None)
 def fase_por_dominio(dominio, mds=None):
     if dominio == "almacigos":
         return "vivero_establecimiento"
@@ -117,280 +161,372 @@ def fase_por_dominio(dominio, mds=None):
 
 # Criterios (reglas)
 
+# Tabla de criterios: idx -> (dominio, fase, ventana_MDS, tecnicas, tradicionales, luna_preferida|None).
+# Ventana_MDS: tuple (min_mds, max_mds) si aplica; None para almácigos/broca.
+_CRITERIOS = {
+    1: ("almacigos", "vivero_establecimiento", None,
+        (
+            "Uso de Micorrizas arbusculares 10–20 g/bolsa en germinadores y almácigos favorece la absorción de fósforo y otros nutrientes.",
+            "Aplicar Fosfato diamónico (DAP) 2 g/bolsa."
+        ),
+        (
+            "Preparar y aplicar insecticidas naturales a base de ají, ajenjo y ajo, los cuales funcionan como repelentes para prevenir y controlar insectos.",
+            "Sembrar plantas alelopáticas para repeler plagas en almácigos y en el cultivo de café.",
+            "Elaborar compost con cáscara de coco y residuos de finca o cocina.",
+            "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
+        ),
+        None),
+    2: ("almacigos", "vivero_establecimiento", None,
+        (
+            "Aplicar mezcla Urea:DAP (3:2) equivalente a NPK 20-10-10, 20 g/planta, dos meses después de la siembra, para estimular raíces y hojas verdaderas.",
+        ),
+        (
+            "Sembrar hileras de maíz para incorporación orgánica tras su cosecha.",
+            "Sembrar leguminosas (frijol, habichuela) para fijar nitrógeno y mejorar la fertilidad   del suelo; además ayudan a suprimir ciertas malezas, atraen insectos benéficos como abejas y reducen el uso de abonos sintéticos.",
+            "Establecimiento de árboles maderables (nogal cafetero, guamo) como sombra natural para los cafetales.",
+            "Evitar limpieza de cafetales en luna menguante, pues se asocia con la proliferación de hormigas o cochinillas.",
+            "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
+        ),
+        "menguante"),
+    3: ("fertilizacion_sin_suelo", "floracion_llenado", (6,12),
+        (
+            "Agregar cal dolomítica o cal agrícola hasta 150 g/planta/año al menos dos meses antes del trasplante o durante corrección del suelo; no mezclar con fertilizantes.",
+        ),
+        (
+            "Sembrar hileras de maíz para incorporación orgánica tras su cosecha.",
+            "Sembrar leguminosas (frijol, habichuela) para fijar nitrógeno y mejorar la fertilidad   del suelo; además ayudan a suprimir ciertas malezas, atraen insectos benéficos como abejas y reducen el uso de abonos sintéticos.",
+            "Establecimiento de árboles maderables (nogal cafetero, guamo) como sombra natural para los cafetales",
+            "Evitar limpieza de cafetales en luna menguante, pues se asocia con la proliferación de hormigas o cochinillas.",
+            "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
+        ),
+        "menguante"),
+    4: ("fertilizacion_sin_analisis", "floracion_llenado", (18,24),
+        (
+            "Fertilizar con NPK alto en K (25-4-24, 26-4-22 o 23-4-20-3Mg) 1000–1200 kg/ha/año en 2–3 aplicaciones (≈200–300 g/planta/año).",
+        ),
+        (
+            "Sembrar hileras de maíz para incorporación orgánica tras su cosecha.",
+            "Sembrar leguminosas (frijol, habichuela) para fijar nitrógeno y mejorar la fertilidad   del suelo; además ayudan a suprimir ciertas malezas, atraen insectos benéficos como abejas y reducen el uso de abonos sintéticos.",
+            "Establecimiento de árboles maderables (nogal cafetero, guamo) como sombra natural para los cafetales",
+            "Evitar limpieza de cafetales en luna menguante, pues se asocia con la proliferación de hormigas o cochinillas.",
+            "Evitar limpiezas en luna llena por aparición rápida de arvenses.",
+            "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
+        ),
+        None),  # reglas de luna; no es requisito de fase
+    5: ("fertilizacion_sin_analisis", "cosecha_postcosecha", (24, 48),
+        (
+            "Plan anual NPK potásico (25-4-24, 26-4-22 o 23-4-20-3Mg): 150–300 kg N/ha-año, 30–60 kg P₂O₅/ha-año, 150–300 kg K₂O/ha-año en 2–3 aplicaciones (≈200–300 g/planta/año).",
+        ),
+        (
+            "Evitar cosecha durante luna creciente (posible pérdida de peso del grano).",
+            "No dejar frutos secos en árboles o suelo; recolectar y solarizar para eliminar broca.",
+            "Utilizar frutos infestados por broca, hervirlos en agua para eliminar huevos o larvas y evitar su diseminación."
+
+        ),
+        "menguante"),  # preferible no-cosecha creciente; usamos menguante como favorable para labores culturales
+    6: ("fertilizacion_sin_analisis", "cosecha_postcosecha", (48, 72),
+        (
+            "Aplicar compost + fuente potásica (K₂O) 200 g/planta para recuperar la fertilidad del suelo tras cosecha.",
+        ),
+        (
+            "Evitar la cosecha de café durante la luna creciente, ya que se cree que el grano pierde peso en esta fase.",
+            "Utilizar frutos infestados por broca, hervirlos en agua para eliminar huevos o larvas y evitar su diseminación.",
+            "No eliminar chupones de las zocas en luna creciente, ya que los brotes crecen con mayor rapidez."
+        ),
+        "menguante"),
+}
+
 def criterios(criterio_idx):
     """
-    Devuelve (dominio, fase, ventana_MDS, tecnicas[], tradicionales[], luna_preferida|None).
-    Ventana_MDS: tuple (min_mds, max_mds) si aplica; None para almácigos/broca.
+    Devuelve (dominio, fase, ventana_MDS, tecnicas, tradicionales, luna_preferida|None) de _CRITERIOS.
+    Las listas son tuplas compartidas: el resultado no se debe modificar.
     """
-    if criterio_idx == 1:
-        return ("almacigos", "vivero_establecimiento", None,
-                [
-                    "Uso de Micorrizas arbusculares 10–20 g/bolsa en germinadores y almácigos favorece la absorción de fósforo y otros nutrientes.",
-                    "Aplicar Fosfato diamónico (DAP) 2 g/bolsa."
-                ],
-                [
-                    "Preparar y aplicar insecticidas naturales a base de ají, ajenjo y ajo, los cuales funcionan como repelentes para prevenir y controlar insectos.",
-                    "Sembrar plantas alelopáticas para repeler plagas en almácigos y en el cultivo de café.",
-                    "Elaborar compost con cáscara de coco y residuos de finca o cocina.",
-                    "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
-                ],
-                None)
-    if criterio_idx == 2:
-        return ("almacigos", "vivero_establecimiento", None,
-                [
-                    "Aplicar mezcla Urea:DAP (3:2) equivalente a NPK 20-10-10, 20 g/planta, dos meses después de la siembra, para estimular raíces y hojas verdaderas."
-                ],
-                [
-                    "Sembrar hileras de maíz para incorporación orgánica tras su cosecha.",
-                    "Sembrar leguminosas (frijol, habichuela) para fijar nitrógeno y mejorar la fertilidad   del suelo; además ayudan a suprimir ciertas malezas, atraen insectos benéficos como abejas y reducen el uso de abonos sintéticos.",
-                    "Establecimiento de árboles maderables (nogal cafetero, guamo) como sombra natural para los cafetales.",
-                    "Evitar limpieza de cafetales en luna menguante, pues se asocia con la proliferación de hormigas o cochinillas.",
-                    "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
-                ],
-                "menguante")
-    if criterio_idx == 3:
-        return ("fertilizacion_sin_suelo", "floracion_llenado", (6,12),
-                [
-                    "Agregar cal dolomítica o cal agrícola hasta 150 g/planta/año al menos dos meses antes del trasplante o durante corrección del suelo; no mezclar con fertilizantes."
-                ],
-                [
-                    "Sembrar hileras de maíz para incorporación orgánica tras su cosecha.",
-                    "Sembrar leguminosas (frijol, habichuela) para fijar nitrógeno y mejorar la fertilidad   del suelo; además ayudan a suprimir ciertas malezas, atraen insectos benéficos como abejas y reducen el uso de abonos sintéticos.",
-                    "Establecimiento de árboles maderables (nogal cafetero, guamo) como sombra natural para los cafetales",
-                    "Evitar limpieza de cafetales en luna menguante, pues se asocia con la proliferación de hormigas o cochinillas.",
-                    "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
-                ],
-                "menguante")
-    if criterio_idx == 4:
-        return ("fertilizacion_sin_analisis", "floracion_llenado", (18,24),
-                [
-                    "Fertilizar con NPK alto en K (25-4-24, 26-4-22 o 23-4-20-3Mg) 1000–1200 kg/ha/año en 2–3 aplicaciones (≈200–300 g/planta/año)."
-                ],
-                [
-                    "Sembrar hileras de maíz para incorporación orgánica tras su cosecha.",
-                    "Sembrar leguminosas (frijol, habichuela) para fijar nitrógeno y mejorar la fertilidad   del suelo; además ayudan a suprimir ciertas malezas, atraen insectos benéficos como abejas y reducen el uso de abonos sintéticos.",
-                    "Establecimiento de árboles maderables (nogal cafetero, guamo) como sombra natural para los cafetales",
-                    "Evitar limpieza de cafetales en luna menguante, pues se asocia con la proliferación de hormigas o cochinillas.",
-                    "Evitar limpiezas en luna llena por aparición rápida de arvenses.",
-                    "Siembra de jengibre alrededor del cultivo como repelente natural contra serpientes."
-                ],
-                None)  # reglas de luna; no es requisito de fase
-    if criterio_idx == 5:
-        return ("fertilizacion_sin_analisis", "cosecha_postcosecha", (24, 48),
-                [
-                    "Plan anual NPK potásico (25-4-24, 26-4-22 o 23-4-20-3Mg): 150–300 kg N/ha-año, 30–60 kg P₂O₅/ha-año, 150–300 kg K₂O/ha-año en 2–3 aplicaciones (≈200–300 g/planta/año)."
-                ],
-                [
-                    "Evitar cosecha durante luna creciente (posible pérdida de peso del grano).",
-                    "No dejar frutos secos en árboles o suelo; recolectar y solarizar para eliminar broca.",
-                    "Utilizar frutos infestados por broca, hervirlos en agua para eliminar huevos o larvas y evitar su diseminación."
-
-                ],
-                "menguante")  # preferible no-cosecha creciente; usamos menguante como favorable para labores culturales
-    if criterio_idx == 6:
-        return ("fertilizacion_sin_analisis", "cosecha_postcosecha", (48, 72),
-                [
-                    "Aplicar compost + fuente potásica (K₂O) 200 g/planta para recuperar la fertilidad del suelo tras cosecha."
-                ],
-                [
-                    "Evitar la cosecha de café durante la luna creciente, ya que se cree que el grano pierde peso en esta fase.",
-                    "Utilizar frutos infestados por broca, hervirlos en agua para eliminar huevos o larvas y evitar su diseminación.",
-                    "No eliminar chupones de las zocas en luna creciente, ya que los brotes crecen con mayor rapidez."
-                ],
-                "menguante")
-    raise ValueError("criterio_idx inválido")
+    try:
+        return _CRITERIOS[criterio_idx]
+    except KeyError:
+        raise ValueError("criterio_idx inválido") from None
 
 
 # *************** Reglas de recomendación por dominio (extienden criterios)
 
 def recomendaciones_almacigos(case, criterio_idx):
-    rec = {"tecnicas": [], "tradicionales": []}
     dominio, fase, _, tecnicas_pdf, trad_pdf, luna_pref = criterios(criterio_idx)
-    # Añadimos texto del criterio
-    rec["tecnicas"].extend(tecnicas_pdf)
-    rec["tradicionales"].extend(trad_pdf)
+    # Añadimos texto del criterio (las listas quedan en locales para no buscarlas en rec cada vez)
+    tecnicas, tradicionales = list(tecnicas_pdf), list(trad_pdf)
+    rec = {"tecnicas": tecnicas, "tradicionales": tradicionales}
 
     # Ajustes por contexto 
-    edad = case["almacigos"]["edad_vivero_meses"]
-    bolsa = case["almacigos"]["tamaño_bolsa_kg"]
+    alm, clima = case["almacigos"], case["clima"]
+    edad = alm["edad_vivero_meses"]
+    bolsa = alm["tamaño_bolsa_kg"]
     sombra = case["contexto"]["sombra_pct"]
-    rh = case["clima"]["humedad"]
-    tmed = case["clima"]["temp_media"]
+    rh = clima["humedad"]
+    tmed = clima["temp_media"]
 
     if edad is not None:
         if edad <= 2:
-            rec["tecnicas"].append("Solución nutritiva 0,05% NPK cada 15 días; evitar 17-6-18 en edades ≤2 meses, solo aplicar este fertilizante en cafetales en fase de producción.")
+            tecnicas.append("Solución nutritiva 0,05% NPK cada 15 días; evitar 17-6-18 en edades ≤2 meses, solo aplicar este fertilizante en cafetales en fase de producción.")
         elif edad <= 4:
-            rec["tecnicas"].append("0,1% NPK balanceado o 10 g/bolsa/mes fraccionado; monitorear sanidad del sustrato.")
+            tecnicas.append("0,1% NPK balanceado o 10 g/bolsa/mes fraccionado; monitorear sanidad del sustrato.")
         else:
-            rec["tecnicas"].append("12–15 g/bolsa/mes (fraccionado quincenal) con NPK + Ca/Mg si hay deficiencias.")
+            tecnicas.append("12–15 g/bolsa/mes (fraccionado quincenal) con NPK + Ca/Mg si hay deficiencias.")
 
     objetivo = "30–40%" if (sombra < 30 or sombra > 40) else "mantener 30–40%"
-    rec["tecnicas"].append(f"Ajustar sombra a {objetivo} y mejorar ventilación del vivero.")
-    rec["tecnicas"].append("Tratamiento preventivo con Trichoderma spp. en sustrato (1 vez/mes).")
-    rec["tecnicas"].append("Riegos ligeros diarios; evitar encharcamientos y compactación.")
+    tecnicas.append(f"Ajustar sombra a {objetivo} y mejorar ventilación del vivero.")
+    tecnicas.append("Tratamiento preventivo con Trichoderma spp. en sustrato (1 vez/mes).")
+    tecnicas.append("Riegos ligeros diarios; evitar encharcamientos y compactación.")
 
     if edad and edad >= 5 and (bolsa is not None and bolsa <= 1.0):
-        rec["tecnicas"].append("Trasplantar a campo a los 5–6 meses o cambiar a bolsa de 2 kg si se retrasa.")
+        tecnicas.append("Trasplantar a campo a los 5–6 meses o cambiar a bolsa de 2 kg si se retrasa.")
     if tmed < 18 and rh > 80:
-        rec["tecnicas"].append("Barreras rompe-viento y drenajes para prevenir Phoma en condiciones frías y húmedas.")
+        tecnicas.append("Barreras rompe-viento y drenajes para prevenir Phoma en condiciones frías y húmedas.")
 
-    rec["tradicionales"].append("Evitar trasplantes con suelos saturados por lluvia.")
+    tradicionales.append("Evitar trasplantes con suelos saturados por lluvia.")
     return rec, luna_pref
 
 def recomendaciones_fertilizacion(case, criterio_idx):
-    rec = {"tecnicas": [], "tradicionales": []}
     dominio, fase, ventana, tecnicas_pdf, trad_pdf, luna_pref = criterios(criterio_idx)
-    rec["tecnicas"].extend(tecnicas_pdf)
-    rec["tradicionales"].extend(trad_pdf)
+    tecnicas, tradicionales = list(tecnicas_pdf), list(trad_pdf)
+    rec = {"tecnicas": tecnicas, "tradicionales": tradicionales}
 
     mds = case["fertilizacion_sin_suelo"]["meses_despues_siembra"]
     prec = case["clima"]["prec_total_mm"]
     if mds is not None:
         if mds <= 2:
-            rec["tecnicas"].append("Post-trasplante (≤2 MDS): 15–20 g/planta mezcla rica en N (urea:DAP 3:2); evitar excesos.")
+            tecnicas.append("Post-trasplante (≤2 MDS): 15–20 g/planta mezcla rica en N (urea:DAP 3:2); evitar excesos.")
         elif mds in (6,):
-            rec["tecnicas"].append("6 MDS: 20 g/planta de urea; ajustar según vigor y precipitación.")
+            tecnicas.append("6 MDS: 20 g/planta de urea; ajustar según vigor y precipitación.")
         elif mds in (10,):
-            rec["tecnicas"].append("10 MDS: 40 g/planta NPK (urea:DAP:KCl 3:1.5:1) + 2 g MgO.")
+            tecnicas.append("10 MDS: 40 g/planta NPK (urea:DAP:KCl 3:1.5:1) + 2 g MgO.")
         elif mds in (14,):
-            rec["tecnicas"].append("14 MDS: 30 g/planta de urea; fraccionar si es lluvioso.")
+            tecnicas.append("14 MDS: 30 g/planta de urea; fraccionar si es lluvioso.")
         elif mds in (18,):
-            rec["tecnicas"].append("18 MDS: 60 g/planta NPK (3:1.1:1.5) + 3 g MgO; incorporar levemente.")
+            tecnicas.append("18 MDS: 60 g/planta NPK (3:1.1:1.5) + 3 g MgO; incorporar levemente.")
         else:
-            rec["tecnicas"].append("Interpolar dosis entre hitos; fraccionar cuando la lluvia es alta.")
+            tecnicas.append("Interpolar dosis entre hitos; fraccionar cuando la lluvia es alta.")
 
     if prec > 150:
-        rec["tecnicas"].append("Fraccionar la dosis en 2 aplicaciones separadas 45 días.")
-    rec["tecnicas"].append("Aplicar en corona 25–35 cm e incorporar superficialmente; evitar suelo saturado.")
+        tecnicas.append("Fraccionar la dosis en 2 aplicaciones separadas 45 días.")
+    tecnicas.append("Aplicar en corona 25–35 cm e incorporar superficialmente; evitar suelo saturado.")
     # Tradicional con luna
     if luna_pref == "menguante":
-        rec["tradicionales"].append("Aplicar Fertilizantes preferiblemente en menguante y en la tarde.")
+        tradicionales.append("Aplicar Fertilizantes preferiblemente en menguante y en la tarde.")
     return rec, luna_pref
 
 def recomendaciones_broca(case):
-    rec = {"tecnicas": [], "tradicionales": []}
-    semanas = case["broca"]["semanas_desde_ultimo_pase"]
-    inf = case["broca"]["infestacion_pct"]
-    rh = case["clima"]["humedad"]
-    tmed = case["clima"]["temp_media"]
+    tecnicas, tradicionales = [], []
+    rec = {"tecnicas": tecnicas, "tradicionales": tradicionales}
+    broca, clima = case["broca"], case["clima"]
+    semanas = broca["semanas_desde_ultimo_pase"]
+    inf = broca["infestacion_pct"]
+    rh = clima["humedad"]
+    tmed = clima["temp_media"]
 
     if semanas >= 2:
-        rec["tecnicas"].append("Realizar repase completo entre 21–25 días desde el último pase.")
-    rec["tecnicas"].append("Recolectar todos los frutos del suelo y remanentes (cero frutos remanentes).")
+        tecnicas.append("Realizar repase completo entre 21–25 días desde el último pase.")
+    tecnicas.append("Recolectar todos los frutos del suelo y remanentes (cero frutos remanentes).")
     if (inf >= 2.0) or (tmed > 21 and rh < 75):
-        rec["tecnicas"].append("Aplicar Beauveria bassiana (1×10^8 conidios/ml) 500 ml/planta cada 30 días con HR>70%.")
-    rec["tecnicas"].append("Ajustar calendario de cosecha para no dejar >5% de frutos sobremaduros.")
-    rec["tradicionales"].append("No dejar frutos secos en los árboles ni en el suelo; recolectarlos y almacenarlos en bolsas plásticas o estopas para que el calor elimine la broca.")
-    rec["tradicionales"].append("Cosecha intensiva durante repases.")
+        tecnicas.append("Aplicar Beauveria bassiana (1×10^8 conidios/ml) 500 ml/planta cada 30 días con HR>70%.")
+    tecnicas.append("Ajustar calendario de cosecha para no dejar >5% de frutos sobremaduros.")
+    tradicionales.append("No dejar frutos secos en los árboles ni en el suelo; recolectarlos y almacenarlos en bolsas plásticas o estopas para que el calor elimine la broca.")
+    tradicionales.append("Cosecha intensiva durante repases.")
     return rec
 
 # *************** Caso común + constructores
 
-def case_common():
-    muni = random.choice(MUNICIPIOS)
-    alt = pick_altitud()
-    mes = random.choice(MESES)
-    clima = build_clima(alt, mes)
-    return {
+def case_common_batch(n, validar=False):
+    """
+    Contexto + clima de n casos: municipio, variedad, altitud, mes, sombra y clima se sortean por columnas
+    y los dicts por caso se arman al final (con tipos de Python para el YAML).
+    Con validar=True devuelve además la máscara de validar_batch sobre las columnas de clima.
+    """
+    alts = pick_altitud(n)
+    mes_idx = rng.integers(0, 12, n)
+    clima_cols = build_clima_batch(alts, mes_idx)
+    validos = validar_batch(clima_cols) if validar else None
+    clima = {k: v.tolist() for k, v in clima_cols.items()}
+    sombra = np.clip(rng.normal(35, 10, n), 10, 60).astype(int).tolist()
+    muni = rng.integers(0, len(MUNICIPIOS), n).tolist()
+    var = rng.integers(0, len(VARIEDADES), n).tolist()
+    alts, mes_idx = alts.tolist(), mes_idx.tolist()
+    bases = [{
         "contexto": {
-            "ubicacion": muni,
-            "altitud_msnm": alt,
-            "mes": mes,
-            "variedad": random.choice(VARIEDADES),
-            "sombra_pct": int(np.clip(np.random.normal(35, 10), 10, 60))
+            "ubicacion": MUNICIPIOS[muni[i]],
+            "altitud_msnm": alts[i],
+            "mes": MESES[mes_idx[i]],
+            "variedad": VARIEDADES[var[i]],
+            "sombra_pct": sombra[i]
         },
-        "clima": clima
-    }
+        "clima": {k: col[i] for k, col in clima.items()}
+    } for i in range(n)]
+    return (bases, validos) if validar else bases
 
-def make_case_almacigos(idx):
-    base = case_common()
-    criterio_idx = random.choice([1,2])  # criterios de vivero
-    edad = int(np.clip(round(np.random.normal(3.5, 1.5)), 1, 8))
-    bolsa = 1.0 if random.random() < 0.7 else 2.0
+def case_common():
+    return case_common_batch(1)[0]
+
+# Valores aleatorios propios de cada dominio, sorteados por columnas para n casos
+SUSTRATOS = ["suelo_limpio","mezcla_suelo+MO","compostado"]
+VENTILACIONES = ["baja","media","alta"]
+MDS_SIN_VENTANA = [1,2,3,4,5,6,8,10,12,14,16,18,20,22,24]
+SEMANAS_PASE = [1,2,3,4,5]
+ESQUEMAS_COSECHA = ["una_cosecha","principal+mitaca"]
+EVENTOS_CLIMATICOS = ["Neutro","El_Nino","La_Nina"]
+_LUNAS_OBJ = np.array(LUNAS, dtype=object)
+
+def _filas(cols):
+    """Columnas (arreglos) -> lista de dicts por caso, con tipos de Python."""
+    cols = {k: v.tolist() for k, v in cols.items()}
+    return [dict(zip(cols, vals)) for vals in zip(*cols.values())]
+
+def _elegir(opciones, n):
+    # como rng.choice(opciones, n) (mismo sorteo), pero devuelve los mismos objetos str de `opciones`
+    return np.array(opciones, dtype=object)[rng.integers(0, len(opciones), n)]
+
+def _luna_al_azar(n, p):
+    # con probabilidad p una fase lunar al azar; si no, None
+    return np.where(rng.random(n) < p, _LUNAS_OBJ[rng.integers(0, len(LUNAS), n)], None)
+
+def sorteos_almacigos(n):
+    sanidad = rng.random((n, 6)) < np.array([0.07, 0.06, 0.16, 0.15, 0.05, 0.10])
+    return _filas({
+        "criterio_idx": rng.choice([1,2], n),   # criterios de vivero
+        "edad": np.clip(np.rint(rng.normal(3.5, 1.5, n)), 1, 8).astype(int),
+        "bolsa": np.where(rng.random(n) < 0.7, 1.0, 2.0),
+        "rhizoctonia": sanidad[:, 0],
+        "nematodos": sanidad[:, 1],
+        "mancha_hierro": sanidad[:, 2],
+        "roya": np.where(sanidad[:, 3], np.round(np.maximum(0.0, rng.normal(1.0, 1.0, n)), 1), 0.0),
+        "phoma": sanidad[:, 4],
+        "cochinillas": sanidad[:, 5],
+        "sustrato_origen": _elegir(SUSTRATOS, n),
+        "micorrizas": rng.random(n) < 0.4,
+        "ventilacion": _elegir(VENTILACIONES, n),
+        "luna": _luna_al_azar(n, 0.35)
+    })
+
+# Ventana MDS de cada criterio como tablas indexadas por criterio_idx (se indexan con el arreglo
+# de criterios sorteados, sin recorrer caso por caso)
+_VENTANAS = [_CRITERIOS[c][2] if c in _CRITERIOS else None for c in range(max(_CRITERIOS) + 1)]
+_VENTANA_LO = np.array([(v or (0, 0))[0] for v in _VENTANAS], dtype=float)
+_VENTANA_HI = np.array([(v or (0, 0))[1] for v in _VENTANAS], dtype=float)
+_CON_VENTANA = np.array([v is not None for v in _VENTANAS], dtype=bool)
+
+def sorteos_fertilizacion(n):
+    crit = rng.choice([3,4,5,6], n)
+    lo, hi = _VENTANA_LO[crit], _VENTANA_HI[crit]
+    mds = np.where(_CON_VENTANA[crit], np.clip(np.rint(rng.uniform(lo, hi)), 0, 72),
+                   rng.choice(MDS_SIN_VENTANA, n)).astype(int)
+    return _filas({
+        "criterio_idx": crit,
+        "mds": mds,
+        "numero_plantas": rng.uniform(3000, 8000, n).astype(int),
+        "oxido_magnesio": rng.random(n) < 0.9,
+        "densidad_siembra": rng.uniform(3500, 7000, n).astype(int),
+        "luna": _luna_al_azar(n, 0.25)
+    })
+
+def sorteos_broca(n):
+    return _filas({
+        "semanas": rng.choice(SEMANAS_PASE, n),
+        "ruido_infestacion": rng.normal(0, 0.7, n),
+        "esquema_cosechas": _elegir(ESQUEMAS_COSECHA, n),
+        "evento_climatico": _elegir(EVENTOS_CLIMATICOS, n)
+    })
+
+# Bloques de los dominios que no aplican al caso: plantillas que se copian en cada caso
+# (copias y no el mismo objeto, para que el YAML no los emita como anclas/alias)
+_ALMACIGOS_VACIO = {
+    "edad_vivero_meses": None, "tamaño_bolsa_kg": None,
+    "estado_sanitario": {"rhizoctonia": False, "nematodos": False, "mancha_hierro": False,
+                         "roya": 0.0, "phoma": False, "cochinillas": False},
+    "sustrato_origen": None, "uso_micorrizas": None, "ventilacion": None
+}
+_FERT_VACIO = {
+    "meses_despues_siembra": None, "numero_plantas": None,
+    "disponibilidad_insumos": {"urea": None, "dap": None, "kcl": None, "oxido_magnesio": None},
+    "densidad_siembra": None
+}
+_BROCA_VACIO = {"semanas_desde_ultimo_pase": None, "infestacion_pct": None,
+                "esquema_cosechas": None, "evento_climatico": None}
+
+def _vacio(plantilla):
+    """Copia de una plantilla de bloque vacío (también sus sub-dicts)."""
+    return {k: v.copy() if isinstance(v, dict) else v for k, v in plantilla.items()}
+
+def make_case_almacigos(idx, base=None, s=None):
+    base = base if base is not None else case_common()
+    s = s if s is not None else sorteos_almacigos(1)[0]
+    criterio_idx = s["criterio_idx"]
     base["almacigos"] = {
-        "edad_vivero_meses": edad,
-        "tamaño_bolsa_kg": bolsa,
+        "edad_vivero_meses": s["edad"],
+        "tamaño_bolsa_kg": s["bolsa"],
         "estado_sanitario": {
-            "rhizoctonia": random.random() < 0.07,
-            "nematodos": random.random() < 0.06,
-            "mancha_hierro": random.random() < 0.16,
-            "roya": round(max(0.0, np.random.normal(1.0, 1.0)), 1) if random.random() < 0.15 else 0.0,
-            "phoma": random.random() < 0.05,
-            "cochinillas": random.random() < 0.10
+            "rhizoctonia": s["rhizoctonia"],
+            "nematodos": s["nematodos"],
+            "mancha_hierro": s["mancha_hierro"],
+            "roya": s["roya"],
+            "phoma": s["phoma"],
+            "cochinillas": s["cochinillas"]
         },
-        "sustrato_origen": random.choice(["suelo_limpio","mezcla_suelo+MO","compostado"]),
-        "uso_micorrizas": True if criterio_idx == 1 else (random.random() < 0.4),
-        "ventilacion": random.choice(["baja","media","alta"])
-    }
-    base["fertilizacion_sin_suelo"] = {
-        "meses_despues_siembra": None, "numero_plantas": None,
-        "disponibilidad_insumos": {"urea": None, "dap": None, "kcl": None, "oxido_magnesio": None},
-        "densidad_siembra": None
+        "sustrato_origen": s["sustrato_origen"],
+        "uso_micorrizas": True if criterio_idx == 1 else s["micorrizas"],
+        "ventilacion": s["ventilacion"]
     }
-    base["broca"] = {"semanas_desde_ultimo_pase": None, "infestacion_pct": None,
-                     "esquema_cosechas": None, "evento_climatico": None}
+    base["fertilizacion_sin_suelo"] = _vacio(_FERT_VACIO)
+    base["broca"] = _BROCA_VACIO.copy()
     base["fase_fenologica"] = "vivero_establecimiento"
     recs, luna_pref = recomendaciones_almacigos(base, criterio_idx)
     # Luna preferida si existe
-    base["luna_fase"] = luna_pref if luna_pref else (random.choice(LUNAS) if random.random() < 0.35 else None)
+    base["luna_fase"] = luna_pref if luna_pref else s["luna"]
     base.update({
         "id": f"ALM-{idx:04d}",
         "tipo": "almacigos",
         "recomendaciones": recs,
-        "fuente_caso_base": f"Criterio {criterio_idx} + Lineamientos Cenicafé"
+        "fuente_caso_base": _c(f"Criterio {criterio_idx} + Lineamientos Cenicafé")
     })
     return base
 
-def make_case_fertilizacion(idx):
-    base = case_common()
-    criterio_idx = random.choice([3,4,5,6])
+def make_case_fertilizacion(idx, base=None, s=None):
+    base = base if base is not None else case_common()
+    s = s if s is not None else sorteos_fertilizacion(1)[0]
+    criterio_idx = s["criterio_idx"]
     dominio, fase_pdf, ventana, _, _, luna_pref = criterios(criterio_idx)
-    if ventana:
-        mds = int(np.clip(round(np.random.uniform(*ventana)), 0, 72))
-    else:
-        mds = random.choice([1,2,3,4,5,6,8,10,12,14,16,18,20,22,24])
+    mds = s["mds"]   # dentro de la ventana MDS del criterio (sorteos_fertilizacion)
     base["fertilizacion_sin_suelo"] = {
         "meses_despues_siembra": mds,
-        "numero_plantas": int(np.random.uniform(3000, 8000)),
-        "disponibilidad_insumos": {"urea": True, "dap": True, "kcl": True, "oxido_magnesio": random.random() < 0.9},
-        "densidad_siembra": int(np.random.uniform(3500, 7000))
+        "numero_plantas": s["numero_plantas"],
+        "disponibilidad_insumos": {"urea": True, "dap": True, "kcl": True, "oxido_magnesio": s["oxido_magnesio"]},
+        "densidad_siembra": s["densidad_siembra"]
     }
-    base["almacigos"] = {"edad_vivero_meses": None, "tamaño_bolsa_kg": None,
-                         "estado_sanitario": {"rhizoctonia": False,"nematodos": False,"mancha_hierro": False,"roya": 0.0,"phoma": False,"cochinillas": False},
-                         "sustrato_origen": None, "uso_micorrizas": None, "ventilacion": None}
-    base["broca"] = {"semanas_desde_ultimo_pase": None, "infestacion_pct": None,
-                     "esquema_cosechas": None, "evento_climatico": None}
+    base["almacigos"] = _vacio(_ALMACIGOS_VACIO)
+    base["broca"] = _BROCA_VACIO.copy()
     # Fase: usamos la del criterio; si MDS<=1, permitir vivero_establecimiento
     base["fase_fenologica"] = fase_pdf if not (mds <= 1 and fase_pdf != "vivero_establecimiento") else "vivero_establecimiento"
     recs, luna_pdf = recomendaciones_fertilizacion(base, criterio_idx)
-    base["luna_fase"] = luna_pdf if luna_pdf else (random.choice(LUNAS) if random.random() < 0.25 else None)
+    base["luna_fase"] = luna_pdf if luna_pdf else s["luna"]
     base.update({
         "id": f"FERT-{idx:04d}",
         "tipo": "fertilizacion_sin_analisis",
         "recomendaciones": recs,
-        "fuente_caso_base": f"Criterio {criterio_idx} + Lineamientos Cenicafé"
+        "fuente_caso_base": _c(f"Criterio {criterio_idx} + Lineamientos Cenicafé")
     })
     return base
 
-def make_case_broca(idx):
-    base = case_common()
-    semanas = random.choice([1,2,3,4,5])
+def make_case_broca(idx, base=None, s=None):
+    base = base if base is not None else case_common()
+    s = s if s is not None else sorteos_broca(1)[0]
+    semanas = s["semanas"]
     t = base["clima"]["temp_media"]
     inf_base = 1.5 if t < 20 else (2.5 if t < 22 else 3.5)
-    inf = float(np.clip(np.random.normal(inf_base + 0.4*(semanas-2), 0.7), 0.2, 9.0))
+    inf = min(max(inf_base + 0.4*(semanas-2) + s["ruido_infestacion"], 0.2), 9.0)
     base["broca"] = {
         "semanas_desde_ultimo_pase": semanas,
         "infestacion_pct": round(inf, 1),
-        "esquema_cosechas": random.choice(["una_cosecha","principal+mitaca"]),
-        "evento_climatico": random.choice(["Neutro","El_Nino","La_Nina"])
+        "esquema_cosechas": s["esquema_cosechas"],
+        "evento_climatico": s["evento_climatico"]
     }
-    base["almacigos"] = {"edad_vivero_meses": None, "tamaño_bolsa_kg": None,
-                         "estado_sanitario": {"rhizoctonia": False,"nematodos": False,"mancha_hierro": False,"roya": 0.0,"phoma": False,"cochinillas": False},
-                         "sustrato_origen": None, "uso_micorrizas": None, "ventilacion": None}
-    base["fertilizacion_sin_suelo"] = {"meses_despues_siembra": None,"numero_plantas": None,
-                                       "disponibilidad_insumos": {"urea": None,"dap": None,"kcl": None,"oxido_magnesio": None},
-                                       "densidad_siembra": None}
+    base["almacigos"] = _vacio(_ALMACIGOS_VACIO)
+    base["fertilizacion_sin_suelo"] = _vacio(_FERT_VACIO)
     base["fase_fenologica"] = "cosecha_postcosecha"
     base["luna_fase"] = None
     recs = recomendaciones_broca(base)
@@ -404,6 +540,25 @@ def make_case_broca(idx):
 
 # *************** Validación de coherencia
 
+# Umbrales realistas del clima: (mensaje, ((variable, mínimo, máximo), ...))
+_CLIMA_BOUNDS = (
+    ("temperaturas fuera de umbrales realistas",
+     (("temp_min", 8, 22), ("temp_max", 18, 35), ("temp_media", 12, 26.5))),
+    ("humedad fuera de rango", (("humedad", 55, 98),)),
+    ("precipitacion fuera de rango", (("prec_total_mm", 40, 260),)),
+    ("brillo solar fuera de rango", (("brillo_solar", 3.5, 8.5),)),
+    ("días de lluvia fuera de rango", (("dias_lluvia", 5, 27),)),
+)
+
+def validar_batch(clima_arrays):
+    """Máscara booleana de los casos cuyo clima (columnas NumPy) cumple todos los _CLIMA_BOUNDS."""
+    ok = np.ones(len(clima_arrays["temp_media"]), dtype=bool)
+    for _, reglas in _CLIMA_BOUNDS:
+        for k, lo, hi in reglas:
+            v = clima_arrays[k]
+            ok &= (v >= lo) & (v <= hi)
+    return ok
+
 def validar_caso(c):
     dom = c.get("tipo")
     fase = c.get("fase_fenologica")
@@ -423,67 +578,83 @@ def validar_caso(c):
         fase_esperada = fase_por_dominio("fertilizacion_sin_analisis", mds)
         if fase not in ("floracion_llenado", "vivero_establecimiento", "cosecha_postcosecha"):
             ok = False; msg.append(f"fase '{fase}' no válida")
-    # Rangos clima básicos
+    # Rangos clima básicos (mismos umbrales que validar_batch)
     clima = c.get("clima") or {}
-    tmed = clima.get("temp_media")
-    tmin = clima.get("temp_min")
-    tmax = clima.get("temp_max")
-    rh = clima.get("humedad")
-    prec = clima.get("prec_total_mm")
-    brillo = clima.get("brillo_solar")
-    dllu = clima.get("dias_lluvia")
-    if not (8 <= tmin <= 22 and 18 <= tmax <= 35 and 12 <= tmed <= 26.5):
-        ok = False; msg.append("temperaturas fuera de umbrales realistas")
-    if not (55 <= rh <= 98):
-        ok = False; msg.append("humedad fuera de rango")
-    if not (40 <= prec <= 260):
-        ok = False; msg.append("precipitacion fuera de rango")
-    if not (3.5 <= brillo <= 8.5):
-        ok = False; msg.append("brillo solar fuera de rango")
-    if not (5 <= dllu <= 27):
-        ok = False; msg.append("días de lluvia fuera de rango")
+    get = clima.get
+    for mensaje, reglas in _CLIMA_BOUNDS:
+        if not all(lo <= get(k) <= hi for k, lo, hi in reglas):
+            ok = False; msg.append(mensaje)
     return ok, "; ".join(msg)
 
 # *************** Exportadores
 
 def save_yaml(cases, path):
+    """
+    Escribe la lista YAML caso por caso: cada caso se emite como un ítem '- ...' de la
+    misma lista, así que `cases` puede ser un generador y no se arma el documento completo.
+    """
+    n = 0
     with open(path, "w", encoding="utf-8") as f:
-        yaml.safe_dump(cases, f, allow_unicode=True, sort_keys=False)
+        for c in cases:
+            yaml.dump([c], f, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+            n += 1
+        if n == 0:
+            f.write("[]\n")
+    return n
+
+# Columnas del resumen por caso (CSV de muestra y gráfico), en orden
+PREVIEW_CAMPOS = ("id", "tipo", "fase", "luna", "ubicacion", "altitud_msnm", "mes", "sombra_pct",
+                  "temp_media", "humedad", "prec_total_mm", "rec1", "rec2")
 
 def flatten_for_preview(c):
+    """Valores del resumen de un caso, en el orden de PREVIEW_CAMPOS."""
     tecnicas = (c.get("recomendaciones") or {}).get("tecnicas", [])
     t1 = tecnicas[0] if len(tecnicas) > 0 else ""
     t2 = tecnicas[1] if len(tecnicas) > 1 else ""
-    return {
-        "id": c["id"],
-        "tipo": c["tipo"],
-        "fase": c.get("fase_fenologica"),
-        "luna": c.get("luna_fase"),
-        "ubicacion": c["contexto"]["ubicacion"],
-        "altitud_msnm": c["contexto"]["altitud_msnm"],
-        "mes": c["contexto"]["mes"],
-        "sombra_pct": c["contexto"]["sombra_pct"],
-        "temp_media": c["clima"]["temp_media"],
-        "humedad": c["clima"]["humedad"],
-        "prec_total_mm": c["clima"]["prec_total_mm"],
-        "rec1": t1,
-        "rec2": t2
-    }
+    ctx, clima = c["contexto"], c["clima"]
+    return (c["id"], c["tipo"], c.get("fase_fenologica"), c.get("luna_fase"),
+            ctx["ubicacion"], ctx["altitud_msnm"], ctx["mes"], ctx["sombra_pct"],
+            clima["temp_media"], clima["humedad"], clima["prec_total_mm"], t1, t2)
+
+def resumen_vacio(n):
+    """
+    Resumen por columnas: {campo: lista con un valor por caso}. Las n posiciones se reservan de
+    entrada (la cantidad de casos se conoce antes de armarlos) y se llenan con poner_en_resumen.
+    """
+    return {k: [None] * n for k in PREVIEW_CAMPOS}
 
-def save_preview_csv(cases, path, n=50):
-    df = pd.DataFrame([flatten_for_preview(c) for c in cases])
-    sample = df.sample(min(n, len(df)), random_state=123).reset_index(drop=True)
-    sample.to_csv(path, index=False, encoding="utf-8")
-    return sample
+def poner_en_resumen(resumen, i, c):
+    for col, v in zip(resumen.values(), flatten_for_preview(c)):
+        col[i] = v
 
-def plot_validacion(cases, path_png):
-    altitudes = [c["contexto"]["altitud_msnm"] for c in cases]
-    tmed = [c["clima"]["temp_media"] for c in cases]
+def save_preview_csv(resumen, path, n=50):
+    """
+    `resumen`: columnas de resumen_vacio/poner_en_resumen. Escribe una muestra de n filas con csv
+    (sin pandas); la muestra es la misma que daba DataFrame.sample(n, random_state=123).
+    Las filas se arman al escribirlas (generador, sin copia de la muestra). Devuelve los índices
+    de los casos de la muestra.
+    """
+    total = len(resumen["id"])
+    idx = np.random.RandomState(123).choice(total, min(n, total), replace=False).tolist()
+    cols = tuple(resumen.values())
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, lineterminator="\n")
+        w.writerow(resumen)
+        w.writerows(tuple(col[i] for col in cols) for i in idx)
+    return idx
+
+def plot_validacion(resumen, path_png):
+    # matplotlib se importa aquí (arranque del módulo más liviano), con backend sin ventana
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    altitudes = resumen["altitud_msnm"]
+    tmed = resumen["temp_media"]
     plt.figure(figsize=(7,5))
     plt.scatter(altitudes, tmed, s=10, alpha=0.5)
     plt.xlabel("Altitud (m s. n. m.)")
     plt.ylabel("Temperatura media (°C)")
-    plt.title(f"Validación: Temperatura media vs Altitud (Cauca, {len(cases)} casos)")
+    plt.title(f"Validación: Temperatura media vs Altitud (Cauca, {len(altitudes)} casos)")
     plt.grid(True, alpha=0.2)
     plt.tight_layout()
     plt.savefig(path_png, dpi=150)
@@ -493,165 +664,298 @@ def plot_validacion(cases, path_png):
 # *************** Limpieza y coherencia textual
 
 import unicodedata
-from collections import Counter
+
+class _AsciiFold(dict):
+    """
+    Tabla para str.translate: cada carácter -> su forma ASCII de NFD en minúsculas (tildes fuera;
+    sin equivalente, como '–' o '≤', se elimina). Se llena al ver cada carácter por primera vez.
+    """
+    def __missing__(self, cp):
+        r = self[cp] = unicodedata.normalize("NFD", chr(cp)).encode("ascii", "ignore").decode("ascii").lower()
+        return r
+
+_ASCII_FOLD = _AsciiFold()
 
 def _normalize_text_line(s: str) -> str:
     if s is None:
         return ""
-    s2 = unicodedata.normalize("NFD", s).encode("ascii", "ignore").decode("ascii")
-    s2 = s2.lower()
-    s2 = s2.replace("–", "-").replace("—","-")
-    s2 = re.sub(r"\s+", " ", s2).strip()
-    s2 = re.sub(r"[.;:]+$", "", s2)
-    return s2
-
-def _titlecase_first(s: str) -> str:
+    # una pasada de translate en C equivale a NFD + encode("ascii", "ignore") + lower() sobre toda
+    # la línea; split/join colapsa espacios y rstrip quita la puntuación final, sin regex
+    return " ".join(s.translate(_ASCII_FOLD).split()).rstrip(".;:")
+
+# Clave normalizada por línea: las de los criterios se calculan al importar y las demás
+# (textos fijos de las reglas por dominio) la primera vez que aparecen
+_NORM_CACHE = {
+    ln: _normalize_text_line(ln)
+    for idx in range(1, 7) for ln in (*criterios(idx)[3], *criterios(idx)[4])
+}
+
+def _norm_key(line: str) -> str:
+    key = _NORM_CACHE.get(line)
+    if key is None:
+        key = _NORM_CACHE[line] = _normalize_text_line(line)
+    return key
+
+def _finalize(s: str) -> str:
+    """Redacción final de una línea: sin espacios al borde, mayúscula inicial y punto final."""
+    s = s.strip() if s else s
     if not s:
         return s
-    s = s.strip()
-    return s[0].upper() + s[1:] if s else s
+    return s[0].upper() + s[1:] + ("" if s.endswith(".") else ".")
+
+# Palabras clave de las reglas de keep() en una sola alternancia sobre la línea normalizada.
+# '12–15' con raya queda '1215' al normalizar (la raya no tiene equivalente ASCII).
+_KEEP_RE = re.compile(
+    r"(?P<micorrizas>micorriz)"
+    r"|(?P<beauveria>beauveria)"
+    r"|(?P<fraccionar>fraccionar la dosis)"
+    r"|(?P<dosis_alta>12-15 g/bolsa/mes|1215 g/bolsa/mes)"
+    r"|(?P<cambio_bolsa>cambiar a bolsa de 2 kg)"
+)
+
+# Palabras clave (sobre la línea normalizada) de las reglas 6 y 7 de limpiar_recomendaciones
+_MENGUANTE = "menguante"
+_EVITAR = "evitar"
+_APLICAR = "aplicar"
+_UREA_DAP_CLAVES = ("urea:dap (3:2)", "urea:dap 3:2")
+_NPK_010_CLAVES = ("0,1% npk balanceado", "10 g/bolsa/mes fraccionado")
+
+# clave normalizada -> (evitar+menguante, aplicar+menguante, urea_dap, npk_010, reglas de keep());
+# las líneas se repiten en miles de casos, así que cada una se revisa una sola vez
+_RASGOS = {}
+
+def _rasgos(n):
+    r = _RASGOS.get(n)
+    if r is None:
+        men = _MENGUANTE in n
+        r = _RASGOS[n] = (men and _EVITAR in n, men and _APLICAR in n,
+                          any(k in n for k in _UREA_DAP_CLAVES), any(k in n for k in _NPK_010_CLAVES),
+                          frozenset(m.lastgroup for m in _KEEP_RE.finditer(n)))
+    return r
+
+def _procesar_lineas(pairs, keep, registrar, quitar_npk_010=False):
+    """
+    Limpia una lista de pares (línea, clave normalizada) y devuelve las líneas finales;
+    `registrar((motivo, línea))` anota cada eliminación.
+    Primera pasada: filtro keep() y detección de lo que depende de toda la lista (contradicción
+    de luna, presencia de Urea:DAP / 0,1% NPK). Segunda pasada sobre las que quedan: quita
+    'aplicar ... menguante' si hay conflicto, la redundancia NPK (almácigos), duplicados por
+    clave y deja mayúscula inicial + punto final.
+    """
+    vivas = None       # se arma solo si keep() descarta alguna línea; si no, son los mismos `pairs`
+    evitar_men = False
+    aplicar_idx = []   # posiciones (en vivas) de las líneas 'aplicar ... menguante'
+    # vistos[am]: si aparece en líneas con (True) o sin (False) 'aplicar ... menguante'
+    urea_vista = [False, False]
+    npk_vista = [False, False]
+    for i, p in enumerate(pairs):
+        if not keep(p):
+            if vivas is None:
+                vivas = pairs[:i]
+            continue
+        ev, am, urea, npk, _ = _rasgos(p[1])
+        if ev:
+            evitar_men = True
+        if am:
+            aplicar_idx.append(i if vivas is None else len(vivas))
+        if quitar_npk_010:
+            if urea:
+                urea_vista[am] = True
+            if npk:
+                npk_vista[am] = True
+        if vivas is not None:
+            vivas.append(p)
+    if vivas is None:
+        vivas = pairs
 
-def _ensure_period(s: str) -> str:
-    if not s:
-        return s
-    s = s.strip()
-    return s if s.endswith(".") else s + "."
+    # 6) Contradicciones de luna (preferimos "evitar" sobre "aplicar")
+    conflicto_luna = evitar_men and bool(aplicar_idx)
+    quitar = frozenset(aplicar_idx) if conflicto_luna else ()
+    if conflicto_luna:
+        registrar(("luna_contradictoria_menguante", "aplicar en menguante (eliminado)"))
+    # 7) Redundancias específicas almácigos: Urea:DAP 3:2 vs 0,1% NPK/10 g bolsa/mes;
+    # se mantiene Urea:DAP (criterio 2). Cuenta lo que sobrevive al paso 6.
+    redundante = (quitar_npk_010
+                  and (urea_vista[False] or (urea_vista[True] and not conflicto_luna))
+                  and (npk_vista[False] or (npk_vista[True] and not conflicto_luna)))
 
-def _dedup_list_preserving_order(lines):
-    seen = set()
     out = []
-    for ln in lines:
-        key = _normalize_text_line(ln)
-        if key not in seen and key != "":
-            seen.add(key)
-            out.append(ln)
+    seen = set()
+    for i, (ln, n) in enumerate(vivas):
+        if quitar and i in quitar:
+            continue
+        if redundante and _rasgos(n)[3]:
+            registrar(("redundancia_npk_010", ln))
+            continue
+        # Deduplicar preservando orden y normalizar redacción
+        if n not in seen and n != "":
+            seen.add(n)
+            out.append(_c(_finalize(ln)))
     return out
 
-def limpiar_recomendaciones(caso):
+def _no_registrar(_motivo):
+    pass
+
+def limpiar_recomendaciones(caso, collect_removed=False):
+    """
+    Quita recomendaciones incoherentes con el contexto, duplicadas o contradictorias y normaliza
+    su redacción. Devuelve (caso, removed): la lista de (motivo, línea) eliminadas solo si
+    collect_removed=True; si no, None (la generación no la usa).
+    """
+    removed = [] if collect_removed else None
+    registrar = removed.append if collect_removed else _no_registrar
     rec = (caso.get("recomendaciones") or {"tecnicas":[], "tradicionales":[]})
-    tecnicas = list(rec.get("tecnicas") or [])
-    tradicionales = list(rec.get("tradicionales") or [])
+    # Cada línea va con su clave normalizada (calculada una vez) hasta escribir el resultado
+    tecnicas = [(ln, _norm_key(ln)) for ln in rec.get("tecnicas") or []]
+    tradicionales = [(ln, _norm_key(ln)) for ln in rec.get("tradicionales") or []]
+    if not tecnicas and not tradicionales:
+        caso["recomendaciones"] = {"tecnicas": [], "tradicionales": []}
+        return caso, removed
     clima = caso.get("clima") or {}
     alm = caso.get("almacigos") or {}
-    removed = []
 
-    # Reglas de eliminación por incoherencia contextual
+    # Reglas de eliminación por incoherencia contextual: dependen solo del caso, así que cada
+    # condición se evalúa una vez aquí y keep() solo mira si la línea menciona la regla
     rh = clima.get("humedad")
     prec = clima.get("prec_total_mm")
     edad = alm.get("edad_vivero_meses")
     bolsa = alm.get("tamaño_bolsa_kg")
-    uso_mic = alm.get("uso_micorrizas")
-
-    def keep(line):
-        n = _normalize_text_line(line)
+    mic_incoherente = alm.get("uso_micorrizas") is False
+    hr_baja = isinstance(rh,(int,float)) and rh < 70
+    sin_lluvia_alta = isinstance(prec,(int,float)) and prec <= 150
+    edad_baja = edad is not None and edad <= 2
+    bolsa_2kg = isinstance(bolsa,(int,float)) and bolsa >= 2.0
+
+    def keep(pair):
+        line, n = pair
+        reglas = _rasgos(n)[4]
+        if not reglas:
+            return True
 
         # 1) micorrizas incoherente
-        if "micorriz" in n and uso_mic is False:
-            removed.append(("micorrizas_incoherente", line)); return False
+        if "micorrizas" in reglas and mic_incoherente:
+            registrar(("micorrizas_incoherente", line)); return False
 
         # 2) beauveria con HR < 70
-        if "beauveria" in n and isinstance(rh,(int,float)) and rh < 70:
-            removed.append(("beauveria_hr<70", line)); return False
+        if "beauveria" in reglas and hr_baja:
+            registrar(("beauveria_hr<70", line)); return False
 
         # 3) fraccionar por lluvia sin lluvia alta
-        if "fraccionar la dosis" in n and isinstance(prec,(int,float)) and prec <= 150:
-            removed.append(("fraccionamiento_sin_lluvia", line)); return False
+        if "fraccionar" in reglas and sin_lluvia_alta:
+            registrar(("fraccionamiento_sin_lluvia", line)); return False
 
         # 4) dosis altas 12-15 g/bolsa/mes en edades <=2
-        if ("12-15 g/bolsa/mes" in n or "12–15 g/bolsa/mes" in line) and (edad is not None and edad <= 2):
-            removed.append(("dosis_alta_edad_baja", line)); return False
+        if "dosis_alta" in reglas and edad_baja:
+            registrar(("dosis_alta_edad_baja", line)); return False
 
         # 5) cambiar a bolsa de 2 kg si ya es 2 kg
-        if "cambiar a bolsa de 2 kg" in n and isinstance(bolsa,(int,float)) and bolsa >= 2.0:
-            removed.append(("cambio_bolsa_innecesario", line)); return False
+        if "cambio_bolsa" in reglas and bolsa_2kg:
+            registrar(("cambio_bolsa_innecesario", line)); return False
 
         return True
 
-    tecnicas = [ln for ln in tecnicas if keep(ln)]
-    tradicionales = [ln for ln in tradicionales if keep(ln)]
-
-    # 6) Contradicciones de luna (preferimos "evitar" sobre "aplicar")
-    def remove_luna_conflicts(lines):
-        ns = [_normalize_text_line(x) for x in lines]
-        if any(("evitar" in s and "menguante" in s) for s in ns) and any(("aplicar" in s and "menguante" in s) for s in ns):
-            lines = [x for x in lines if not ("aplicar" in _normalize_text_line(x) and "menguante" in _normalize_text_line(x))]
-            removed.append(("luna_contradictoria_menguante", "aplicar en menguante (eliminado)"))
-        return lines
-
-    tecnicas = remove_luna_conflicts(tecnicas)
-    tradicionales = remove_luna_conflicts(tradicionales)
-
-    # 7) Redundancias específicas almácigos: Urea:DAP 3:2 vs 0,1% NPK/10 g bolsa/mes
-    ns_tecn = [_normalize_text_line(x) for x in tecnicas]
-    has_urea_dap = any("urea:dap (3:2)" in s or "urea:dap 3:2" in s for s in ns_tecn)
-    has_npk_010 = any("0,1% npk balanceado" in s or "10 g/bolsa/mes fraccionado" in s for s in ns_tecn)
-    if caso.get("tipo") == "almacigos" and has_urea_dap and has_npk_010:
-        # Mantener Urea:DAP (criterio 2) y quitar la línea de 0,1% para no redundar
-        new_tecn = []
-        for ln in tecnicas:
-            n = _normalize_text_line(ln)
-            if ("0,1% npk balanceado" in n) or ("10 g/bolsa/mes fraccionado" in n):
-                removed.append(("redundancia_npk_010", ln))
-                continue
-            new_tecn.append(ln)
-        tecnicas = new_tecn
-
-    # Deduplicar preservando orden
-    tecnicas = _dedup_list_preserving_order(tecnicas)
-    tradicionales = _dedup_list_preserving_order(tradicionales)
-
-    # Normalizar redacción: mayúscula inicial + punto final
-    tecnicas = [_ensure_period(_titlecase_first(x)) for x in tecnicas]
-    tradicionales = [_ensure_period(_titlecase_first(x)) for x in tradicionales]
+    tecnicas = _procesar_lineas(tecnicas, keep, registrar, quitar_npk_010=caso.get("tipo") == "almacigos")
+    tradicionales = _procesar_lineas(tradicionales, keep, registrar)
 
     caso["recomendaciones"] = {"tecnicas": tecnicas, "tradicionales": tradicionales}
     return caso, removed
 
 # *************** Main
 
+def sortear_espacios():
+    """
+    Sortea por lotes los valores aleatorios de todos los casos y los mezcla: cada 'espacio'
+    (constructor, idx, base, valores) es un caso ya decidido, en su orden final.
+    Toda la aleatoriedad queda aquí; armar los casos no vuelve a sortear.
+    """
+    espacios = []
+    for etiqueta, make_case, sorteos, n in (
+            ("Almácigos", make_case_almacigos, sorteos_almacigos, N_ALMACIGOS),
+            ("Fertilización sin análisis", make_case_fertilizacion, sorteos_fertilizacion, N_FERT),
+            ("Broca", make_case_broca, sorteos_broca, N_BROCA)):
+        print(f"  - {etiqueta} ({n})...")
+        bases, validos = case_common_batch(n, validar=True)
+        pares = [(b, s) for b, s, ok in zip(bases, sorteos(n), validos.tolist()) if ok]
+        if len(pares) < n:
+            print(f"AVISO: {n - len(pares)} casos de {etiqueta} con clima fuera de rango; se descartan.")
+        espacios += [(make_case, i, base, s) for i, (base, s) in enumerate(pares, 1)]
+    # Mezcla con una permutación de índices generada en C (sin N intercambios en Python)
+    return [espacios[i] for i in rng.permutation(len(espacios)).tolist()]
+
+# Fase de respaldo de un caso que no pasa validar_caso: fija por dominio, o según los MDS en
+# fertilización (índice: MDS <= 1, 1 < MDS < 36, MDS >= 36 o sin dato)
+_FASE_FIJA = {"almacigos": "vivero_establecimiento", "broca": "cosecha_postcosecha"}
+_FASES_POR_MDS = ("vivero_establecimiento", "floracion_llenado", "cosecha_postcosecha")
+
+def armar_caso(espacio):
+    """Construye, valida y limpia el caso de un espacio (sin sorteos: determinista)."""
+    make_case, i, base, s = espacio
+    c = make_case(i, base, s)
+    ok, why = validar_caso(c)
+    if not ok:
+        fase = _FASE_FIJA.get(c["tipo"])
+        if fase is None:
+            mds = (c.get("fertilizacion_sin_suelo") or {}).get("meses_despues_siembra")
+            fase = _FASES_POR_MDS[2 if mds is None else (mds > 1) + (mds >= 36)]
+        c["fase_fenologica"] = fase
+    c, _ = limpiar_recomendaciones(c)
+    return c
+
+def iter_cases():
+    """Genera los casos A ya mezclados, uno a uno."""
+    for e in sortear_espacios():
+        yield armar_caso(e)
+
+def _lote_yaml(espacios):
+    # En un proceso del pool: arma un lote y lo devuelve ya serializado, con su resumen por columnas
+    casos = [armar_caso(e) for e in espacios]
+    texto = yaml.dump(casos, Dumper=SafeDumper, allow_unicode=True, sort_keys=False) if casos else ""
+    resumen = resumen_vacio(len(casos))
+    for i, c in enumerate(casos):
+        poner_en_resumen(resumen, i, c)
+    return texto, resumen
+
+def save_yaml_paralelo(espacios, path, procesos):
+    """
+    Igual que save_yaml(map(armar_caso, espacios)) pero arma y serializa lotes en `procesos`
+    procesos; imap conserva el orden de los lotes, así que el archivo es el mismo.
+    Devuelve el resumen por columnas (PREVIEW_CAMPOS) de todos los casos.
+    """
+    lotes = [espacios[a:a + CASOS_POR_LOTE] for a in range(0, len(espacios), CASOS_POR_LOTE)]
+    resumen = resumen_vacio(len(espacios))
+    a = 0
+    with open(path, "w", encoding="utf-8") as f, mp.Pool(procesos) as pool:
+        for texto, resumen_lote in pool.imap(_lote_yaml, lotes):
+            f.write(texto)
+            b = a + len(resumen_lote["id"])
+            for col, col_lote in zip(resumen.values(), resumen_lote.values()):
+                col[a:b] = col_lote
+            a = b
+    return resumen
+
 def main():
     print("Generando Dataset A ...")
-    cases = []
-
-    print(f"  - Almácigos ({N_ALMACIGOS})...")
-    for i in range(1, N_ALMACIGOS+1):
-        c = make_case_almacigos(i)
-        ok, why = validar_caso(c)
-        if not ok:
-            c["fase_fenologica"] = "vivero_establecimiento"
-        c, _removed = limpiar_recomendaciones(c)
-        cases.append(c)
-
-    print(f"  - Fertilización sin análisis ({N_FERT})...")
-    for i in range(1, N_FERT+1):
-        c = make_case_fertilizacion(i)
-        ok, why = validar_caso(c)
-        if not ok:
-            mds = (c.get("fertilizacion_sin_suelo") or {}).get("meses_despues_siembra")
-            c["fase_fenologica"] = "vivero_establecimiento" if (mds is not None and mds <= 1) else ("floracion_llenado" if (mds is not None and mds < 36) else "cosecha_postcosecha")
-        c, _removed = limpiar_recomendaciones(c)
-        cases.append(c)
-
-    print(f"  - Broca ({N_BROCA})...")
-    for i in range(1, N_BROCA+1):
-        c = make_case_broca(i)
-        ok, why = validar_caso(c)
-        if not ok:
-            c["fase_fenologica"] = "cosecha_postcosecha"
-        c, _removed = limpiar_recomendaciones(c)
-        cases.append(c)
-
-    random.shuffle(cases)
-    print(f"Casos generados: {len(cases)}")
+    espacios = sortear_espacios()
 
     print(f"Guardando YAML -> {OUT_YAML}")
-    save_yaml(cases, OUT_YAML)
+    if N_PROCESOS > 1 and len(espacios) >= MIN_CASOS_PARALELO:
+        resumen = save_yaml_paralelo(espacios, OUT_YAML, N_PROCESOS)
+    else:
+        # Los casos se escriben al YAML a medida que se arman; de cada uno solo quedan
+        # sus valores en las columnas del resumen
+        resumen = resumen_vacio(len(espacios))
+        def con_resumen(cases):
+            for i, c in enumerate(cases):
+                poner_en_resumen(resumen, i, c)
+                yield c
+        save_yaml(con_resumen(map(armar_caso, espacios)), OUT_YAML)
+    print(f"Casos generados: {len(resumen['id'])}")
 
     print(f"Creando muestra CSV (50 casos) -> {OUT_CSV}")
-    _ = save_preview_csv(cases, OUT_CSV, n=50)
+    _ = save_preview_csv(resumen, OUT_CSV, n=50)
 
     print(f"Generando gráfico de validación -> {OUT_PNG}")
-    plot_validacion(cases, OUT_PNG)
+    plot_validacion(resumen, OUT_PNG)
 
     print("Listo.")
     print(f" - {Path(OUT_YAML).resolve()}")
@@ -34,11 +34,13 @@ APLICA_DOMINIO = {
 
 # *************** Utilidades numéricas
 
+# sin/cos del ángulo de cada mes, calculados una sola vez (el dominio son 12 valores)
+_MES_IDX = {m: i for i, m in enumerate(MESES)}
+_MES_SIN_COS = tuple((math.sin(2.0 * math.pi * (i / 12.0)), math.cos(2.0 * math.pi * (i / 12.0)))
+                     for i in range(12))
+
 def mes_to_sin_cos(mes: str):
-    m = (mes or "").strip().lower()
-    idx = MESES.index(m) if m in MESES else 0
-    ang = 2.0 * math.pi * (idx / 12.0)
-    return math.sin(ang), math.cos(ang)
+    return _MES_SIN_COS[_MES_IDX.get((mes or "").strip().lower(), 0)]
 
 def safe_float(x, default=None):
     try:
@@ -76,8 +78,7 @@ def inferir_fase(altitud: float, mes: str, mds: float | None) -> str:
     except Exception:
         pass
 
-    m = (mes or "").strip().lower()
-    idx = MESES.index(m) if m in MESES else 0
+    idx = _MES_IDX.get((mes or "").strip().lower(), 0)
     alt = float(altitud) if altitud is not None else 1650.0
 
     if alt >= 1500:
@@ -517,25 +518,16 @@ def combinar_recs_genericas(hits_dom):
     Combina recomendaciones técnicas y tradicionales de k (Dataset A),
     eliminando repeticiones textuales.
     """
-    tecnicas = []
-    tradicionales = []
-    seen_t = set()
-    seen_trad = set()
-
-    for sim, case in hits_dom:
-        rec = case.get("recomendaciones") or {}
-        for t in rec.get("tecnicas") or []:
-            t = (t or "").strip()
-            if t and t not in seen_t:
-                seen_t.add(t)
-                tecnicas.append(t)
-        for tr in rec.get("tradicionales") or []:
-            tr = (tr or "").strip()
-            if tr and tr not in seen_trad:
-                seen_trad.add(tr)
-                tradicionales.append(tr)
-
-    return {"tecnicas": tecnicas, "tradicionales": tradicionales}
+    def textos(clave):
+        for sim, case in hits_dom:
+            for t in (case.get("recomendaciones") or {}).get(clave) or []:
+                t = (t or "").strip()
+                if t:
+                    yield t
+
+    # dict.fromkeys deduplica conservando el orden de aparición
+    return {"tecnicas": list(dict.fromkeys(textos("tecnicas"))),
+            "tradicionales": list(dict.fromkeys(textos("tradicionales")))}
 
 # *************** Combinación aparte para kB (extras_B)
 
@@ -550,11 +542,9 @@ def agrupar_extras_B(extras_B):
         txt = (e.get("texto") or "").strip()
         if not txt:
             continue
-        if cat not in grupos:
-            grupos[cat] = []
-        if txt not in grupos[cat]:
-            grupos[cat].append(txt)
-    return grupos
+        # dict por categoría como conjunto ordenado (sin recorrer la lista en cada texto)
+        grupos.setdefault(cat, {})[txt] = None
+    return {cat: list(textos) for cat, textos in grupos.items()}
 
 # *************** Retención (Dataset C)
 
@@ -0,0 +1,16 @@
+# conftest.py
+# ==========================================
+# Rutas compartidas por las pruebas: cbr_cafe y api_cbr se importan desde su carpeta
+# (igual que al ejecutarlos), sin empaquetar.
+# ==========================================
+
+import sys
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+API_DIR = RAIZ / "app" / "api_cbr"
+GENERADOR_A = RAIZ / "datasets" / "Generaror dataset A" / "generador_dataset_A.py"
+DATA_AB = [str(API_DIR / "CBR_Cafe_Cauca_A.yaml"), str(API_DIR / "CBR_Cafe_Cauca_B_historicos.yaml")]
+
+if str(API_DIR) not in sys.path:
+    sys.path.insert(0, str(API_DIR))
@@ -0,0 +1,44 @@
+# test_arranque.py
+# ==========================================
+# Humo: los módulos se importan sin dependencias de graficado y el API responde
+# a /cbr/recomendar con los YAML por defecto (sin guardar caso).
+# ==========================================
+
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+from conftest import API_DIR, GENERADOR_A
+
+def _modulos_tras_importar(codigo):
+    # Intérprete nuevo: sys.modules no hereda lo que pytest u otras pruebas ya importaron
+    out = subprocess.run([sys.executable, "-c", codigo + "\nimport sys; print(' '.join(sys.modules))"],
+                         capture_output=True, text=True, check=True)
+    return set(out.stdout.split())
+
+def test_generador_no_importa_matplotlib_ni_pandas():
+    mods = _modulos_tras_importar(
+        "import importlib.util as u\n"
+        f"spec = u.spec_from_file_location('generador_dataset_A', {str(GENERADOR_A)!r})\n"
+        "spec.loader.exec_module(u.module_from_spec(spec))"
+    )
+    assert "matplotlib" not in mods
+    assert "pandas" not in mods
+
+def test_cbr_cafe_no_importa_fastapi():
+    mods = _modulos_tras_importar(f"import sys; sys.path.insert(0, {str(API_DIR)!r}); import cbr_cafe")
+    assert "cbr_cafe" in mods
+    assert "fastapi" not in mods
+
+def test_recomendar_responde(monkeypatch):
+    # DEFAULT_DATA son rutas relativas a la carpeta del API
+    monkeypatch.chdir(API_DIR)
+    import api_cbr
+
+    with TestClient(api_cbr.app) as cliente:
+        r = cliente.post("/cbr/recomendar", json={"save_case_to": None})
+    assert r.status_code == 200
+    cuerpo = r.json()
+    assert cuerpo["consulta"]["fase"] == "vivero_establecimiento"
+    assert "resultados_A" in cuerpo
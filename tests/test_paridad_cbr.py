@@ -0,0 +1,160 @@
+# test_paridad_cbr.py
+# ==========================================
+# Paridad del puntaje vectorizado (SoA + kernel) y de la tabla de fases con la
+# versión escalar original: similitud rasgo a rasgo, caso por caso, y sort estable.
+# ==========================================
+
+import random
+
+import numpy as np
+import pytest
+
+import cbr_cafe as cbr
+from conftest import DATA_AB
+
+# =========================
+# Referencia escalar (un caso a la vez, como antes del índice SoA)
+# =========================
+def _clip01(x):
+    return max(0.0, min(1.0, float(x)))
+
+def _sim_numeric(a, b, key):
+    if a is None or b is None:
+        return None
+    lo, hi = cbr.RANGES[key]
+    na, nb = _clip01((a - lo) / (hi - lo)), _clip01((b - lo) / (hi - lo))
+    return _clip01(1.0 - abs(na - nb))
+
+def _sim_luna(a, b):
+    # Fase no reconocida (LUNA_OTRA) no coincide con ninguna, ni consigo misma
+    ia, ib = cbr.luna_id(a), cbr.luna_id(b)
+    if ia < 0 or ib < 0:
+        return None
+    return float(cbr.LUNA_SIM[ia, ib])
+
+def _station_bonus(query_alt, case_station, case_alt):
+    if query_alt is None:
+        return 1.0
+    ref = cbr.STATIONS_ALT.get(case_station, cbr.safe_float(case_alt))
+    if ref is None:
+        return 1.0
+    diff = abs(query_alt - ref)
+    return 1.00 if diff <= 60 else 0.85 if diff <= 120 else 0.70 if diff <= 200 else 0.55
+
+def _vector_consulta(params):
+    msin, mcos = cbr.mes_to_sin_cos(params.get("mes"))
+    v = {k: cbr.safe_float(params.get(cbr.QUERY_FIELDS.get(k, k))) for k in cbr.FEATURES}
+    v.update(mes_sin=msin, mes_cos=mcos, luna_fase=params.get("luna"))
+    return v
+
+def _vector_caso(case):
+    msin, mcos = cbr.mes_to_sin_cos((case.get("contexto") or {}).get("mes"))
+    v = {k: cbr.safe_float((case.get(sec) or {}).get(key)) for k, (sec, key) in cbr.CASE_FIELDS.items()}
+    v.update(mes_sin=msin, mes_cos=mcos, luna_fase=case.get("luna_fase"),
+             edad_vivero_meses=cbr._case_edad_vivero(case))
+    return v
+
+def _similitud(qvec, cvec, pesos):
+    s_num = s_den = 0.0
+    for k, w in pesos.items():
+        if qvec.get(k) is None:
+            continue
+        simk = _sim_luna(qvec[k], cvec.get(k)) if k == "luna_fase" else _sim_numeric(qvec[k], cvec.get(k), k)
+        if simk is None:
+            continue
+        s_num += w * simk
+        s_den += w
+    return 0.0 if s_den <= 0 else _clip01(s_num / s_den)
+
+def _top_k_ref(scored, k):
+    # sort estable de Python: los empates quedan en orden de aparición
+    return sorted(scored, key=lambda x: x[0], reverse=True)[:max(1, k)]
+
+# =========================
+# Consultas aleatorias con semilla fija
+# =========================
+def _consultas(n, seed=20240501):
+    rnd = random.Random(seed)
+    opcional = lambda v: None if rnd.random() < 0.2 else v
+    for _ in range(n):
+        yield {
+            "mes": rnd.choice(cbr.MESES),
+            "altitud": rnd.uniform(1000, 2300),
+            "sombra": opcional(rnd.uniform(0, 80)),
+            "temp_media": rnd.uniform(12, 28),
+            "humedad": rnd.uniform(50, 100),
+            "prec_total_mm": rnd.uniform(0, 400),
+            "dias_lluvia": opcional(rnd.uniform(0, 30)),
+            "brillo_solar": opcional(rnd.uniform(0, 200)),
+            "meses_despues_siembra": opcional(rnd.uniform(0, 30)),
+            "edad_vivero_meses": opcional(rnd.uniform(0, 6)),
+            "luna": rnd.choice(["nueva", "creciente", "llena", "menguante", "otra", None]),
+        }
+
+@pytest.fixture(scope="module")
+def index():
+    return cbr.build_index(DATA_AB)
+
+@pytest.mark.parametrize("params", list(_consultas(8)))
+def test_top_k_A_igual_a_referencia(index, params):
+    q = cbr.pack_query(params)
+    qvec = _vector_consulta(params)
+    for dom, pesos in cbr.WEIGHTS.items():
+        filas = index.A["filas"][dom]
+        scores = cbr.score_cases(index.A, q, filas)
+        ref = [(_similitud(qvec, _vector_caso(c), pesos), c) for c in index.A["cases"][filas]]
+        np.testing.assert_allclose(scores, [s for s, _ in ref], rtol=0, atol=1e-12)
+
+        hits, meta = cbr.top_k_A(index.A, q, dom, 5, "vivero_establecimiento", 10.0)
+        if meta["aplica"]:
+            assert [c["id"] for _, c in hits] == [c["id"] for _, c in _top_k_ref(ref, 5)]
+
+@pytest.mark.parametrize("params", list(_consultas(8, seed=7)))
+def test_extras_B_igual_a_referencia(index, params):
+    q = cbr.pack_query(params)
+    qvec = _vector_consulta(params)
+    ref = []
+    for c in index.B["cases"]:
+        ctx = c.get("contexto") or {}
+        base = _similitud(qvec, _vector_caso(c), cbr.WEIGHTS_B)
+        bono = _station_bonus(params["altitud"], ctx.get("estacion"), ctx.get("altitud_msnm"))
+        ref.append((_clip01(base * bono), c))
+
+    _, top = cbr.extras_from_B(index.B, q, params["altitud"], 5)
+    esperado = _top_k_ref(ref, 5)
+    assert [c["id"] for _, c in top] == [c["id"] for _, c in esperado]
+    np.testing.assert_allclose([s for s, _ in top], [s for s, _ in esperado], rtol=0, atol=1e-12)
+
+# =========================
+# Fase por (altitud, mes): tabla frente a la regla if/elif original
+# =========================
+def _inferir_fase_ref(altitud, mes):
+    idx = cbr.mes_index(mes)
+    alt = float(altitud) if altitud is not None else 1650.0
+    if alt >= 1500:
+        grupos = ([0, 1, 2, 3], [4, 5, 6, 7])
+    else:
+        grupos = ([11, 0, 1, 2], [3, 4, 5, 6])
+    if idx in grupos[0]:
+        return "vivero_establecimiento"
+    if idx in grupos[1]:
+        return "floracion_llenado"
+    return "cosecha_poscosecha"
+
+@pytest.mark.parametrize("altitud", [None, 1000, 1499.9, 1500, 1678, 2300])
+def test_inferir_fase_igual_a_regla(altitud):
+    for mes in cbr.MESES + ["", None, "Enero "]:
+        assert cbr.inferir_fase(altitud, mes, None) == _inferir_fase_ref(altitud, mes)
+
+# =========================
+# Reparto por hilos (solo se activa con bloques grandes)
+# =========================
+def test_score_cases_en_hilos_igual_a_serial(index, monkeypatch):
+    q = cbr.pack_query(next(_consultas(1)))
+    serial = cbr.score_cases(index.A, q)
+    monkeypatch.setattr(cbr, "PARALELO_MIN_FILAS", 1)
+    monkeypatch.setattr(cbr, "PARALELO_HILOS", 3)
+    try:
+        np.testing.assert_array_equal(cbr.score_cases(index.A, q), serial)
+    finally:
+        cbr.cerrar_pool()